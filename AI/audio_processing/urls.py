@@ -5,4 +5,5 @@ urlpatterns = [
     path('process/', views.process_audio, name='process_audio'),
     path('transcribe/', views.transcribe_audio, name='transcribe_audio'),
     path('analyze/', views.analyze_audio, name='analyze_audio'),
+    path('features/', views.audio_features, name='audio_features'),
 ] 
\ No newline at end of file
@@ -1,8 +1,334 @@
+import io
+import os
+import math
+import base64
+import shutil
+import tempfile
+import subprocess
 import librosa
 import numpy as np
-from scipy.signal import butter, filtfilt
+from functools import lru_cache
+from scipy.signal import butter, filtfilt, firwin, resample_poly
 import soundfile as sf
 
+try:
+    import soxr
+except ImportError:
+    soxr = None
+
+# Uploads larger than this are spooled to an anonymous temporary file while decoding (bytes)
+UPLOAD_MAX_MEMORY_SIZE = 64 * 1024 * 1024
+
+# Resampling modes: target sample rate (None keeps the native rate) and resampler (None for the librosa.load default)
+RESAMPLE_MODES = {
+    'hq': (22050, None),
+    'fast': (22050, 'soxr_qq'),
+    'speech': (16000, 'soxr_qq'),  # speech-only analysis
+    'polyphase': (22050, 'polyphase'),  # scipy polyphase filtering, filter cached per rate pair (no soxr needed)
+    'native': (None, None),
+}
+
+def spool_upload(audio_file, max_memory_size=UPLOAD_MAX_MEMORY_SIZE):
+    """
+    Seekable file object holding an upload: the upload itself when it is seekable (Django uploaded files), otherwise
+    a spooled buffer kept in memory up to max_memory_size bytes
+    """
+    if getattr(audio_file, 'seekable', lambda: False)():
+        audio_file.seek(0)
+        return audio_file
+
+    buffer = tempfile.SpooledTemporaryFile(max_size=max_memory_size)
+    chunks = audio_file.chunks() if hasattr(audio_file, 'chunks') else iter(lambda: audio_file.read(1 << 20), b'')
+    for chunk in chunks:
+        buffer.write(chunk)
+    buffer.seek(0)
+    return buffer
+
+def file_descriptor(source):
+    """
+    File descriptor of a file object backed by an actual file (None for in-memory buffers)
+    """
+    # Django uploaded files and spooled buffers wrap the actual file object
+    source = getattr(source, 'file', source)
+    if isinstance(source, tempfile.SpooledTemporaryFile):
+        source = source._file
+    try:
+        return source.fileno()
+    except (AttributeError, OSError):
+        return None
+
+def decode_with_ffmpeg(source):
+    """
+    Decode any format ffmpeg reads (m4a, aac, ...) into float32 samples (frames, channels) and their sample rate
+    The upload is given to ffmpeg as its standard input: its own file descriptor, an in-memory file (Linux) or a pipe,
+    so that nothing is written to disk
+    """
+    if shutil.which('ffmpeg') is None:
+        raise ValueError('Unsupported audio format (ffmpeg is not available)')
+
+    source.seek(0)
+    fd = file_descriptor(source)
+    data = None
+    memory_fd = None
+    if fd is None and hasattr(os, 'memfd_create'):
+        # Seekable in-memory file (formats indexed at their end, such as mp4, cannot be read from a pipe)
+        memory_fd = fd = os.memfd_create('upload')
+        for chunk in iter(lambda: source.read(1 << 20), b''):
+            os.write(fd, chunk)
+        os.lseek(fd, 0, os.SEEK_SET)
+    elif fd is None:
+        data = source.read()
+    elif hasattr(source, 'flush'):
+        source.flush()
+
+    try:
+        process = subprocess.run(['ffmpeg', '-nostdin', '-v', 'error', '-i', '/dev/stdin' if data is None else 'pipe:0',
+                                  '-f', 'wav', '-acodec', 'pcm_f32le', 'pipe:1'],
+                                 stdin=fd if data is None else None, input=data, capture_output=True)
+    finally:
+        if memory_fd is not None:
+            os.close(memory_fd)
+
+    if process.returncode != 0 or len(process.stdout) == 0:
+        raise ValueError('Unsupported audio format: {}'.format(process.stderr.decode(errors='replace').strip()))
+    return sf.read(io.BytesIO(process.stdout), dtype='float32', always_2d=True)
+
+@lru_cache(maxsize=32)
+def polyphase_filter(orig_sr, target_sr):
+    """
+    Up and down factors and low-pass FIR filter of a polyphase resampling from orig_sr to target_sr (the filter of
+    scipy.signal.resample_poly, designed once per rate pair)
+    """
+    gcd = math.gcd(int(orig_sr), int(target_sr))
+    up, down = int(target_sr) // gcd, int(orig_sr) // gcd
+    max_rate = max(up, down)
+    h = firwin(2 * 10 * max_rate + 1, 1.0 / max_rate, window=('kaiser', 5.0)).astype(np.float32)
+    h.setflags(write=False)
+    return up, down, h
+
+def resample(y, orig_sr, target_sr, res_type=None):
+    """
+    Resample a signal (last axis) with a librosa resampler (librosa default if res_type is None), or with polyphase
+    filtering and a cached filter (also used for soxr resamplers when soxr is not installed)
+    """
+    if orig_sr == target_sr:
+        return y
+    if res_type == 'polyphase' or (res_type is not None and res_type.startswith('soxr') and soxr is None):
+        up, down, h = polyphase_filter(orig_sr, target_sr)
+        return resample_poly(y, up, down, axis=-1, window=h).astype(np.float32, copy=False)
+    if res_type is None:
+        return librosa.resample(y, orig_sr=orig_sr, target_sr=target_sr)
+    return librosa.resample(y, orig_sr=orig_sr, target_sr=target_sr, res_type=res_type)
+
+def decode_audio(audio_file, sr=22050, mono=True, max_memory_size=UPLOAD_MAX_MEMORY_SIZE, res_type=None):
+    """
+    Decode an uploaded audio file into a float32 signal, as librosa.load (mono, resampled to sr with res_type unless
+    sr is None, librosa default resampler if res_type is None), without writing it to disk: formats of libsndfile
+    (wav, flac, ogg, mp3) are read from the upload itself, other formats go through ffmpeg
+    """
+    source = spool_upload(audio_file, max_memory_size)
+    try:
+        try:
+            y, sr_native = sf.read(source, dtype='float32', always_2d=True)
+        except RuntimeError:
+            y, sr_native = decode_with_ffmpeg(source)
+    finally:
+        if source is not audio_file:
+            source.close()
+
+    # Channels first, then mono
+    y = y.T
+    y = librosa.to_mono(y) if mono else np.squeeze(y)
+
+    # Resample
+    if sr is not None and sr != sr_native:
+        y = resample(y, sr_native, sr, res_type=res_type)
+        return y, sr
+    return y, sr_native
+
+class AudioAnalysisSession:
+    """
+    Audio signal decoded once, with a single magnitude spectrogram (and a single mel spectrogram) shared by every
+    feature derived from it: each feature is computed on first request and kept
+    """
+
+    # Features of a session (response keys of process_audio and analyze_audio)
+    FEATURES = ['mfccs', 'spectral_center', 'chroma', 'tempo', 'pitch_mean', 'onset_mean']
+
+    def __init__(self, y, sr, n_fft=2048, hop_length=512):
+        self.y = y
+        self.sr = sr
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self._cache = {}
+
+    @classmethod
+    def from_upload(cls, audio_file, resample_mode='hq', max_memory_size=UPLOAD_MAX_MEMORY_SIZE, **kwargs):
+        """
+        Session of an uploaded audio file (decoded in memory, resampled as resample_mode of RESAMPLE_MODES)
+        """
+        if resample_mode not in RESAMPLE_MODES:
+            raise ValueError('Unknown resample mode: {}'.format(resample_mode))
+        sr, res_type = RESAMPLE_MODES[resample_mode]
+        y, sr = decode_audio(audio_file, sr=sr, max_memory_size=max_memory_size, res_type=res_type)
+        return cls(y, sr, **kwargs)
+
+    def _cached(self, name, compute):
+        if name not in self._cache:
+            self._cache[name] = compute()
+        return self._cache[name]
+
+    @property
+    def duration(self):
+        return librosa.get_duration(y=self.y, sr=self.sr)
+
+    def magnitude(self):
+        """
+        Magnitude spectrogram (the only STFT of the session)
+        """
+        return self._cached('magnitude', lambda: np.abs(librosa.stft(self.y, n_fft=self.n_fft,
+                                                                     hop_length=self.hop_length)))
+
+    def power(self):
+        return self._cached('power', lambda: self.magnitude() ** 2)
+
+    def mel_db(self):
+        """
+        Log-power mel spectrogram (shared by MFCC and onset strength)
+        """
+        return self._cached('mel_db', lambda: librosa.power_to_db(
+            librosa.feature.melspectrogram(S=self.power(), sr=self.sr)))
+
+    def mfcc(self, n_mfcc=13):
+        return self._cached(('mfcc', n_mfcc), lambda: librosa.feature.mfcc(S=self.mel_db(), sr=self.sr,
+                                                                          n_mfcc=n_mfcc))
+
+    def spectral_centroid(self):
+        return self._cached('spectral_centroid', lambda: librosa.feature.spectral_centroid(
+            S=self.magnitude(), sr=self.sr, n_fft=self.n_fft, hop_length=self.hop_length))
+
+    def chroma(self):
+        return self._cached('chroma', lambda: librosa.feature.chroma_stft(
+            S=self.power(), sr=self.sr, n_fft=self.n_fft, hop_length=self.hop_length))
+
+    def onset_strength(self, aggregate=np.mean):
+        return self._cached(('onset_strength', aggregate.__name__), lambda: librosa.onset.onset_strength(
+            S=self.mel_db(), sr=self.sr, hop_length=self.hop_length, aggregate=aggregate))
+
+    def beat_track(self):
+        """
+        Tempo and beat frames (median onset envelope, as librosa.beat.beat_track)
+        """
+        return self._cached('beat_track', lambda: librosa.beat.beat_track(
+            onset_envelope=self.onset_strength(aggregate=np.median), sr=self.sr, hop_length=self.hop_length))
+
+    def piptrack(self):
+        """
+        Pitches and their magnitudes
+        """
+        return self._cached('piptrack', lambda: librosa.piptrack(
+            S=self.magnitude(), sr=self.sr, n_fft=self.n_fft, hop_length=self.hop_length))
+
+    def feature_values(self, names=None):
+        """
+        Values of the requested features (all features by default): (bands, frames) matrices or floats
+        """
+        compute = {
+            'mfccs': self.mfcc,
+            'spectral_center': self.spectral_centroid,
+            'chroma': self.chroma,
+            'tempo': lambda: float(np.atleast_1d(self.beat_track()[0])[0]),
+            'pitch_mean': lambda: float(np.mean(self.piptrack()[0])),
+            'onset_mean': lambda: float(np.mean(self.onset_strength())),
+        }
+        names = self.FEATURES if names is None else names
+        unknown = [name for name in names if name not in compute]
+        if unknown:
+            raise ValueError('Unknown features: {}'.format(', '.join(unknown)))
+        return {name: compute[name]() for name in names}
+
+    def features(self, names=None):
+        """
+        JSON-ready values of the requested features (all features by default)
+        """
+        return format_features(self.feature_values(names))
+
+def summarize_matrix(matrix):
+    """
+    Per-band summary statistics of a (bands, frames) matrix
+    """
+    return {
+        'mean': np.mean(matrix, axis=1).tolist(),
+        'std': np.std(matrix, axis=1).tolist(),
+        'min': np.min(matrix, axis=1).tolist(),
+        'max': np.max(matrix, axis=1).tolist()
+    }
+
+def decimation_step(nb_frames, max_frames):
+    """
+    Number of frames per block so that nb_frames frames are decimated to at most max_frames blocks
+    """
+    return max(1, -(-nb_frames // max_frames))
+
+def decimate_frames(matrix, max_frames):
+    """
+    Mean of consecutive blocks of frames of a (bands, frames) matrix, so that at most max_frames frames are left
+    Returns the decimated matrix and the number of frames per block
+    """
+    step = decimation_step(matrix.shape[1], max_frames)
+    if step == 1:
+        return matrix, step
+    starts = np.arange(0, matrix.shape[1], step)
+    counts = np.diff(np.append(starts, matrix.shape[1]))
+    return np.add.reduceat(matrix, starts, axis=1) / counts, step
+
+def encode_array(matrix, dtype='float32'):
+    """
+    Base64 encoded little-endian binary array, with its type and shape
+    """
+    data = np.ascontiguousarray(matrix, dtype=np.dtype(dtype).newbyteorder('<'))
+    return {
+        'dtype': dtype,
+        'shape': list(data.shape),
+        'data': base64.b64encode(data.tobytes()).decode('ascii')
+    }
+
+# Response formats of feature matrices
+RESPONSE_FORMATS = ['full', 'summary', 'base64', 'binary', 'decimated']
+
+# Types of binary feature matrices
+RESPONSE_DTYPES = ['float32', 'float16']
+
+def format_features(values, response_format='full', dtype='float32', max_frames=100):
+    """
+    JSON-ready feature values: matrices as nested lists (full), per-band statistics (summary), base64 binary arrays of
+    type dtype (base64) or nested lists of at most max_frames frames (decimated); floats are kept as they are
+    """
+    features = {}
+    for name, value in values.items():
+        if not isinstance(value, np.ndarray):
+            features[name] = value
+        elif response_format == 'summary':
+            features[name] = summarize_matrix(value)
+        elif response_format == 'base64':
+            features[name] = encode_array(value, dtype)
+        elif response_format == 'decimated':
+            features[name] = decimate_frames(value, max_frames)[0].tolist()
+        else:
+            features[name] = value.tolist()
+    return features
+
+def features_to_npz(values, dtype='float32', **scalars):
+    """
+    Feature values (matrices of type dtype, floats) and extra scalars written as a NumPy .npz archive
+    """
+    arrays = {name: np.asarray(value, dtype=dtype) if isinstance(value, np.ndarray) else np.asarray(value)
+              for name, value in values.items()}
+    arrays.update({name: np.asarray(value) for name, value in scalars.items()})
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
 def extract_audio_features(y, sr):
     """
     Extract comprehensive audio features
@@ -1,27 +1,88 @@
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
+from django.http import HttpResponse
 import numpy as np
-import librosa
 import soundfile as sf
-import os
 from django.conf import settings
 import tensorflow as tf
 import speech_recognition as sr
 from pydub import AudioSegment
-import tempfile
+from .utils import decode_audio, AudioAnalysisSession, UPLOAD_MAX_MEMORY_SIZE, RESAMPLE_MODES
+from .utils import format_features, features_to_npz, decimation_step, RESPONSE_FORMATS, RESPONSE_DTYPES
 
 # Load audio processing model
 AUDIO_MODEL_PATH = 'models/audio_model.h5'
 
+# Uploads larger than this are spooled to an anonymous temporary file while decoding (bytes)
+AUDIO_UPLOAD_MAX_MEMORY_SIZE = getattr(settings, 'AUDIO_UPLOAD_MAX_MEMORY_SIZE', UPLOAD_MAX_MEMORY_SIZE)
+
+# Resampling mode of the deployment (hq, fast, speech, polyphase or native), overridden by the 'resample' request
+# parameter
+AUDIO_RESAMPLE_MODE = getattr(settings, 'AUDIO_RESAMPLE_MODE', 'hq')
+
 def load_audio_model():
     """Load the audio processing model"""
     return tf.keras.models.load_model(AUDIO_MODEL_PATH)
 
+def get_resample_mode(request):
+    """Resampling mode of a request ('resample' query parameter or form field, deployment mode by default)"""
+    return request.query_params.get('resample') or request.data.get('resample') or AUDIO_RESAMPLE_MODE
+
+def unknown_resample_mode(mode):
+    """Bad request response for an unknown resampling mode"""
+    return Response(
+        {'error': 'Unknown resample mode: {}'.format(mode), 'available': list(RESAMPLE_MODES)},
+        status=status.HTTP_400_BAD_REQUEST
+    )
+
+def get_response_format(request):
+    """
+    Feature matrices format of a request (query parameters): response_format (full, summary, base64, binary or
+    decimated), dtype of binary arrays (float32 or float16) and max_frames of decimated matrices
+    Raises ValueError for invalid values
+    """
+    response_format = request.query_params.get('response_format', 'full')
+    dtype = request.query_params.get('dtype', 'float32')
+    if response_format not in RESPONSE_FORMATS:
+        raise ValueError('Unknown response format: {} (available: {})'.format(response_format,
+                                                                               ', '.join(RESPONSE_FORMATS)))
+    if dtype not in RESPONSE_DTYPES:
+        raise ValueError('Unknown dtype: {} (available: {})'.format(dtype, ', '.join(RESPONSE_DTYPES)))
+    try:
+        max_frames = int(request.query_params.get('max_frames', 100))
+    except ValueError:
+        max_frames = 0
+    if max_frames < 1:
+        raise ValueError('max_frames must be a positive integer')
+    return response_format, dtype, max_frames
+
+def features_response(session, values, response_format='full', dtype='float32', max_frames=100):
+    """
+    Response of feature values in the requested format: JSON, or a NumPy .npz archive for the binary format
+    """
+    if response_format == 'binary':
+        response = HttpResponse(
+            features_to_npz(values, dtype, duration=session.duration, sample_rate=session.sr),
+            content_type='application/octet-stream'
+        )
+        response['Content-Disposition'] = 'attachment; filename="features.npz"'
+        return response
+
+    body = {
+        'features': format_features(values, response_format, dtype, max_frames),
+        'duration': session.duration,
+        'sample_rate': session.sr
+    }
+    if response_format == 'decimated':
+        body['frame_step'] = decimation_step(session.magnitude().shape[1], max_frames)
+    return Response(body)
+
 @api_view(['POST'])
 def process_audio(request):
     """
     Process audio file for analysis
+    (response_format query parameter: full, summary, base64, binary or decimated, see get_response_format)
     """
     try:
         audio_file = request.FILES.get('audio')
@@ -32,32 +93,28 @@ def process_audio(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as temp_file:
-            for chunk in audio_file.chunks():
-                temp_file.write(chunk)
-            temp_path = temp_file.name
+        # Response format
+        try:
+            response_format, dtype, max_frames = get_response_format(request)
+        except ValueError as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-        # Load and process audio
-        y, sr = librosa.load(temp_path)
-        
-        # Extract features
-        mfccs = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
-        spectral_center = librosa.feature.spectral_centroid(y=y, sr=sr)
-        chroma = librosa.feature.chroma_stft(y=y, sr=sr)
+        # Resampling mode
+        resample_mode = get_resample_mode(request)
+        if resample_mode not in RESAMPLE_MODES:
+            return unknown_resample_mode(resample_mode)
+
+        # Decode uploaded file in memory
+        session = AudioAnalysisSession.from_upload(audio_file, resample_mode=resample_mode,
+                                                   max_memory_size=AUDIO_UPLOAD_MAX_MEMORY_SIZE)
         
-        # Clean up temporary file
-        os.unlink(temp_path)
+        # Extract features (one shared STFT)
+        values = session.feature_values(['mfccs', 'spectral_center', 'chroma'])
         
-        return Response({
-            'features': {
-                'mfccs': mfccs.tolist(),
-                'spectral_center': spectral_center.tolist(),
-                'chroma': chroma.tolist()
-            },
-            'duration': librosa.get_duration(y=y, sr=sr),
-            'sample_rate': sr
-        })
+        return features_response(session, values, response_format, dtype, max_frames)
 
     except Exception as e:
         return Response(
@@ -79,24 +136,18 @@ def transcribe_audio(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as temp_file:
-            for chunk in audio_file.chunks():
-                temp_file.write(chunk)
-            temp_path = temp_file.name
+        # Decode uploaded file in memory (native sample rate, 16 bits samples)
+        y, sample_rate = decode_audio(audio_file, sr=None, max_memory_size=AUDIO_UPLOAD_MAX_MEMORY_SIZE)
+        samples = (np.clip(y, -1.0, 1.0) * 32767).astype(np.int16)
 
         # Initialize recognizer
         recognizer = sr.Recognizer()
         
-        # Load audio file
-        with sr.AudioFile(temp_path) as source:
-            audio_data = recognizer.record(source)
+        # Load audio data
+        audio_data = sr.AudioData(samples.tobytes(), sample_rate, 2)
             
-            # Perform transcription
-            text = recognizer.recognize_google(audio_data)
-        
-        # Clean up temporary file
-        os.unlink(temp_path)
+        # Perform transcription
+        text = recognizer.recognize_google(audio_data)
         
         return Response({
             'transcription': text,
@@ -123,36 +174,75 @@ def analyze_audio(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as temp_file:
-            for chunk in audio_file.chunks():
-                temp_file.write(chunk)
-            temp_path = temp_file.name
+        # Resampling mode
+        resample_mode = get_resample_mode(request)
+        if resample_mode not in RESAMPLE_MODES:
+            return unknown_resample_mode(resample_mode)
 
-        # Load audio
-        y, sr = librosa.load(temp_path)
-        
-        # Extract features
-        tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
-        onset_env = librosa.onset.onset_strength(y=y, sr=sr)
-        pitch, _ = librosa.piptrack(y=y, sr=sr)
-        
-        # Calculate statistics
-        pitch_mean = np.mean(pitch)
-        onset_mean = np.mean(onset_env)
+        # Decode uploaded file in memory
+        session = AudioAnalysisSession.from_upload(audio_file, resample_mode=resample_mode,
+                                                   max_memory_size=AUDIO_UPLOAD_MAX_MEMORY_SIZE)
         
-        # Clean up temporary file
-        os.unlink(temp_path)
+        # Extract features and statistics (one shared STFT)
+        analysis = session.features(['tempo', 'pitch_mean', 'onset_mean'])
+        analysis['duration'] = float(session.duration)
         
         return Response({
-            'analysis': {
-                'tempo': float(tempo),
-                'pitch_mean': float(pitch_mean),
-                'onset_mean': float(onset_mean),
-                'duration': float(librosa.get_duration(y=y, sr=sr))
-            }
+            'analysis': analysis
         })
 
+    except Exception as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+@api_view(['POST'])
+def audio_features(request):
+    """
+    Any subset of the process and analyze features of an audio file, from a single decode and a single STFT
+    (features: comma separated names, as query parameter or form field; all features by default)
+    """
+    try:
+        audio_file = request.FILES.get('audio')
+        
+        if not audio_file:
+            return Response(
+                {'error': 'Audio file is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Requested features
+        requested = request.query_params.get('features') or request.data.get('features')
+        names = [name.strip() for name in requested.split(',') if name.strip()] if requested else None
+        unknown = [name for name in names or [] if name not in AudioAnalysisSession.FEATURES]
+        if unknown:
+            return Response(
+                {'error': 'Unknown features: {}'.format(', '.join(unknown)),
+                 'available': AudioAnalysisSession.FEATURES},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Response format
+        try:
+            response_format, dtype, max_frames = get_response_format(request)
+        except ValueError as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Resampling mode
+        resample_mode = get_resample_mode(request)
+        if resample_mode not in RESAMPLE_MODES:
+            return unknown_resample_mode(resample_mode)
+
+        # Decode uploaded file in memory
+        session = AudioAnalysisSession.from_upload(audio_file, resample_mode=resample_mode,
+                                                   max_memory_size=AUDIO_UPLOAD_MAX_MEMORY_SIZE)
+        
+        return features_response(session, session.feature_values(names), response_format, dtype, max_frames)
+
     except Exception as e:
         return Response(
             {'error': str(e)},
@@ -0,0 +1,203 @@
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+from scipy.fft import rfft
+from AudioLibrary.AudioSignal import *
+from AudioLibrary.AudioFeatures import *
+from AudioLibrary.AudioEmotionRecognition import *
+
+
+'''
+AudioLibrary benchmark
+
+Time the feature extractors on synthetic signals of several lengths and sample rates, and write the results as JSON:
+
+    python -m AudioLibrary.AudioBenchmark --output bench.json
+    python -m AudioLibrary.AudioBenchmark --output bench_new.json --compare bench.json --threshold 0.1
+
+Each benchmark reports its best time over several runs, the number of frames processed per second and the peak
+memory allocated during one run. With --compare, the command fails if any benchmark is slower than the same
+benchmark of the reference file by more than the threshold (relative).
+'''
+
+# Short-time features timed one by one
+ST_FEATURES = ['zcr', 'energy', 'energy_entropy', 'spectral_centroid', 'spectral_spread', 'spectral_entropy',
+               'spectral_flux', 'sprectral_rolloff']
+
+# Global statistics
+STATS = ['mean', 'std', 'med', 'kurt', 'skew', 'q1', 'q99', 'min', 'max', 'range']
+
+
+'''
+Classifier, PCA and label encoder stand-ins, so that predict_emotion can be timed without a trained model
+'''
+class StubClassifier:
+
+    def __init__(self, nb_classes=7):
+        self._nb_classes = nb_classes
+
+    def predict(self, X):
+        return numpy.zeros(len(X))
+
+    def predict_proba(self, X):
+        return numpy.full((len(X), self._nb_classes), 1.0 / self._nb_classes)
+
+    def transform(self, X):
+        return X
+
+    def inverse_transform(self, y):
+        return numpy.array(['m_NEU'] * len(y))
+
+
+'''
+Function to build an AudioEmotionRecognition object using stub models
+'''
+def stub_recognition(nb_features, win_size=0.025, win_step=0.01, nb_mfcc=12, dtype=numpy.float64):
+    recognition = AudioEmotionRecognition.__new__(AudioEmotionRecognition)
+    recognition._clf = StubClassifier()
+    recognition._features_param = {"win_size": win_size, "win_step": win_step, "stats": STATS,
+                                   "features_list": ST_FEATURES + ['mfcc'], "nb_mfcc": nb_mfcc, "diff": 0,
+                                   "PCA": False}
+    recognition._features_mean = numpy.zeros(nb_features)
+    recognition._features_std = numpy.ones(nb_features)
+    recognition._pca = StubClassifier()
+    recognition._encoder = StubClassifier()
+    recognition._dtype = numpy.dtype(dtype)
+    recognition._cache = None
+    recognition._predictor = None
+    return recognition
+
+
+'''
+Function to build a synthetic speech-like signal (modulated harmonics plus noise) of 16 bits samples
+'''
+def synthetic_signal(duration, sample_rate, seed=0):
+    random_state = numpy.random.RandomState(seed)
+    t = numpy.arange(int(duration * sample_rate)) / float(sample_rate)
+    pitch = 150 * (1 + 0.2 * numpy.sin(2 * numpy.pi * 0.5 * t))
+    phase = 2 * numpy.pi * numpy.cumsum(pitch) / sample_rate
+    signal = sum(numpy.sin(h * phase) / h for h in range(1, 6)) * (0.5 + 0.5 * numpy.sin(2 * numpy.pi * 3 * t))
+    signal = 8000 * signal + 300 * random_state.randn(len(t))
+    return signal.astype(numpy.int16)
+
+
+'''
+Function to time a function: best time over repeat runs and peak memory of one run
+'''
+def measure(function, repeat=5):
+
+    # Peak memory (traced allocations, numpy buffers included)
+    tracemalloc.start()
+    function()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # Best time
+    best_time = float('inf')
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        best_time = min(best_time, time.perf_counter() - start_time)
+
+    return best_time, peak_memory
+
+
+'''
+Function to run all benchmarks on one synthetic signal
+'''
+def benchmark_signal(duration, sample_rate, win_size=0.025, win_step=0.01, nb_mfcc=12, nb_filter=40, repeat=5,
+                     dtype=numpy.float64):
+
+    # Signal and frames
+    audio_signal = AudioSignal(sample_rate, signal=synthetic_signal(duration, sample_rate), dtype=dtype)
+    audio_features = AudioFeatures(audio_signal, win_size, win_step)
+    frames = audio_signal.frame_array(win_size, win_step, hamming=True)
+    nb_frames = frames.shape[0]
+    dft = numpy.abs(rfft(frames, axis=-1))[:, :int(win_size * sample_rate / 2)] / frames.shape[1]
+    dft_prev = numpy.concatenate((dft[:1], dft[:-1]))
+
+    # Functions to time
+    benchmarks = {}
+    for feature in ST_FEATURES:
+        benchmarks["st_" + feature] = lambda feature=feature: audio_features.compute_st_features(
+            feature, frames, dft, dft_prev, sample_rate)
+    benchmarks["filter_banks"] = lambda: audio_features.filter_banks_coeff(frames, sample_rate, nb_filt=nb_filter)
+    benchmarks["mfcc"] = lambda: audio_features.mfcc(frames, sample_rate, nb_coeff=nb_mfcc, nb_filt=nb_filter)
+    benchmarks["short_time_extraction"] = lambda: audio_features.short_time_feature_extraction(
+        ST_FEATURES + ['mfcc'], nb_mfcc, nb_filter)
+    st_features, f_names = audio_features.short_time_feature_extraction(ST_FEATURES + ['mfcc'], nb_mfcc, nb_filter)
+    benchmarks["global_aggregation"] = lambda: AudioFeatures.global_statistics(st_features, f_names, stats=STATS,
+                                                                               diff=[0, 1, 2])
+    recognition = stub_recognition(len(f_names) * len(STATS), win_size, win_step, nb_mfcc, dtype)
+    benchmarks["predict_emotion"] = lambda: recognition.predict_emotion(audio_signal)
+
+    # Run benchmarks
+    results = {}
+    for name, function in benchmarks.items():
+        best_time, peak_memory = measure(function, repeat)
+        results["{}@{}s_{}Hz".format(name, duration, sample_rate)] = {
+            "benchmark": name, "duration": duration, "sample_rate": sample_rate, "nb_frames": nb_frames,
+            "time": best_time, "frames_per_second": nb_frames / best_time if best_time > 0 else float('inf'),
+            "peak_memory": peak_memory}
+    return results
+
+
+'''
+Function to compare results with reference results: benchmarks slower than reference by more than threshold
+'''
+def compare(results, reference, threshold=0.1):
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name in reference:
+            ratio = result["time"] / reference[name]["time"]
+            if ratio > 1 + threshold:
+                regressions.append((name, ratio))
+    return regressions
+
+
+'''
+Command line
+'''
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Benchmark AudioLibrary feature extractors.")
+    parser.add_argument('--output', default=None, help="JSON file to write results to (default: standard output)")
+    parser.add_argument('--durations', type=float, nargs='+', default=[1, 10, 60], help="signal lengths (s)")
+    parser.add_argument('--sample-rates', type=int, nargs='+', default=[16000, 44100])
+    parser.add_argument('--repeat', type=int, default=5, help="runs per benchmark (best time is kept)")
+    parser.add_argument('--dtype', default='float64', choices=['float32', 'float64'])
+    parser.add_argument('--compare', default=None, help="reference JSON results")
+    parser.add_argument('--threshold', type=float, default=0.1, help="relative slowdown counted as regression")
+    args = parser.parse_args(argv)
+
+    # Run benchmarks
+    results = {}
+    for sample_rate in args.sample_rates:
+        for duration in args.durations:
+            results.update(benchmark_signal(duration, sample_rate, repeat=args.repeat, dtype=args.dtype))
+            print("Benchmark: {} s at {} Hz done".format(duration, sample_rate), file=sys.stderr)
+
+    # Write results
+    output = {"python": platform.python_version(), "numpy": numpy.__version__, "dtype": args.dtype,
+              "results": results}
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=1)
+    else:
+        json.dump(output, sys.stdout, indent=1)
+
+    # Compare with reference
+    if args.compare is not None:
+        regressions = compare(results, json.load(open(args.compare)).get("results"), args.threshold)
+        for name, ratio in regressions:
+            print("Regression: {} is {:.2f}x slower".format(name, ratio), file=sys.stderr)
+        return 1 if len(regressions) > 0 else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
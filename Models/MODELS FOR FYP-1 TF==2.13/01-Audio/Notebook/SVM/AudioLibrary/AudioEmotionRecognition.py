@@ -1,11 +1,46 @@
 import pickle
 from AudioLibrary.AudioSignal import *
 from AudioLibrary.AudioFeatures import *
+from AudioLibrary.FeatureCache import *
+from AudioLibrary.ModelBundle import is_bundle, load_bundle
+from AudioLibrary.FusedPredictor import *
+from AudioLibrary.TimelineWriter import *
 
 
 class AudioEmotionRecognition:
 
-    def __init__(self, model_path):
+    def __init__(self, model_path, cache_path=None, cache_size=1 << 30, dtype=numpy.float64, verify=True, fused=True):
+
+        # Load model bundle (arrays memory-mapped, see ModelBundle)
+        if is_bundle(model_path):
+            (self._clf, self._features_param, (self._features_mean, self._features_std), self._pca,
+             self._encoder) = load_bundle(model_path, verify=verify)
+        else:
+            self.load_pickles(model_path)
+
+        # Floating point type of short-time features computations
+        self._dtype = numpy.dtype(dtype)
+
+        # On-disk features cache (features of files already processed)
+        self._cache = FeatureCache(cache_path, max_size=cache_size) if cache_path is not None else None
+
+        # Scaler, PCA and classifier folded into one NumPy predictor (None to use the sklearn objects)
+        self._predictor = self.fused_predictor() if fused is True else None
+
+    '''
+    Function to build the fused predictor of the model (None if the classifier cannot be fused)
+    '''
+    def fused_predictor(self):
+        try:
+            return FusedPredictor(self._features_mean, self._features_std, self._clf,
+                                  self._pca if self._features_param.get("PCA") is True else None)
+        except (ValueError, AttributeError):
+            return None
+
+    '''
+    Function to load a model from its pickle files
+    '''
+    def load_pickles(self, model_path):
 
         # Load classifier
         self._clf = pickle.load(open(os.path.join(model_path, 'MODEL_CLF.p'), 'rb'))
@@ -34,18 +69,48 @@ class AudioEmotionRecognition:
         return scaled_features
 
     '''
-    Function to predict speech emotion from an audio signals
+    Function to extract global audio features from an audio signals
     '''
-    def predict_emotion(self, audio_signal, predict_proba=False, decode=True):
+    def extract_features(self, audio_signal):
 
         # Extract audio features
         audio_features = AudioFeatures(audio_signal, float(self._features_param.get("win_size")),
-                                       float(self._features_param.get("win_step")))
+                                       float(self._features_param.get("win_step")), dtype=self._dtype)
         features, features_names = audio_features.global_feature_extraction(stats=self._features_param.get("stats"),
                                                                             features_list=self._features_param.get(
                                                                                 "features_list"),
                                                                             nb_mfcc=self._features_param.get("nb_mfcc"),
                                                                             diff=self._features_param.get("diff"))
+        return features
+
+    '''
+    Function to predict speech emotion from an audio signals
+    '''
+    def predict_emotion(self, audio_signal, predict_proba=False, decode=True):
+
+        # Predict emotion from features
+        return self.predict_features(self.extract_features(audio_signal), predict_proba=predict_proba, decode=decode)
+
+    '''
+    Function to predict speech emotion from global audio features
+    '''
+    def predict_features(self, features, predict_proba=False, decode=True):
+
+        # Predict a batch of one
+        return self.predict_features_batch(features.reshape(1, -1), predict_proba=predict_proba, decode=decode)[0]
+
+    '''
+    Function to apply scaling, PCA and classifier to a matrix of global audio features: encoded class of each row, or
+    probability of every class of the encoder (one column per class) with predict_proba=True
+    '''
+    def classify_features(self, features, predict_proba=False):
+
+        # Fused scaling, PCA and classifier
+        if self._predictor is not None:
+            if predict_proba is True:
+                return self._predictor.predict_proba(features)
+            return self._predictor.predict(features)
+
         # Scale features
         features = self.scale_features(features)
 
@@ -55,50 +120,228 @@ class AudioEmotionRecognition:
 
         # Make prediction
         if predict_proba is True:
-            prediction = self._clf.predict_proba(features.reshape(1, -1))
-        else:
-            prediction = self._clf.predict(features.reshape(1, -1))
+            return self._clf.predict_proba(features)
+        return self._clf.predict(features)
+
+    '''
+    Function to predict speech emotion from a matrix of global audio features (one row per chunk)
+    Scaling, PCA and classifier are applied once to the whole matrix (as a single fused predictor when available)
+    '''
+    def predict_features_batch(self, features, predict_proba=False, decode=True):
+
+        # Classes (or probabilities of every class) of all rows
+        prediction = self.classify_features(features, predict_proba=predict_proba)
 
-        # Decode label emotion
+        # Decode label emotion (of the first value of each row)
         if decode is True:
-            prediction = (self._encoder.inverse_transform((prediction.astype(int).flatten())))
+            prediction = self._encoder.inverse_transform(prediction.astype(int).reshape(len(features), -1)[:, 0])
 
         # Remove gender recognition
-        prediction = prediction[0][2:]
+        return [row[2:] for row in prediction]
+
+    '''
+    Function to extract short-time audio features of a whole file, reading it block by block
+    The audio signal is dropped block by block, but the short-time features of every frame are kept: memory grows
+    linearly with the duration (about 3 MB per minute of audio with 10 ms frames and 20 features in float64)
+    '''
+    def stream_short_time_features(self, filename, sample_rate):
 
-        return prediction
+        st_features = []
+        features_names = AudioFeatures.short_time_feature_names(self._features_param.get("features_list"),
+                                                                self._features_param.get("nb_mfcc"))
+        for features, features_names in AudioFeatures.stream_short_time_feature_extraction(
+                filename, sample_rate, float(self._features_param.get("win_size")),
+                float(self._features_param.get("win_step")), features=self._features_param.get("features_list"),
+                nb_mfcc=self._features_param.get("nb_mfcc"), dtype=self._dtype):
+            st_features.append(features)
+
+        if len(st_features) == 0:
+            return numpy.zeros((0, len(features_names)), dtype=self._dtype), features_names
+        return numpy.concatenate(st_features), features_names
+
+    '''
+    Function to extract global audio features of overlapping chunks of a file with a single short-time features
+    extraction over the whole file: the statistics of each chunk are sliding aggregates of the shared frames
+    Chunks must start on frames (chunk_step multiple of win_step). The spectral flux of the first frame of a chunk is
+    computed from the preceding frame of the file, where an independently extracted chunk sets it to 0.
+    '''
+    def extract_sliding_features(self, filename, sample_rate, chunk_size, chunk_step, stream=False):
+
+        # Chunks and short-time windows sizes (samples)
+        chunk_length, chunk_hop = int(chunk_size * sample_rate), int(chunk_step * sample_rate)
+        win_length = int(float(self._features_param.get("win_size")) * sample_rate)
+        win_hop = int(float(self._features_param.get("win_step")) * sample_rate)
+
+        # Frames of a chunk, and frames between two chunks
+        nb_frames = (chunk_length - win_length) // win_hop + 1
+        hop = chunk_hop // win_hop
+
+        # Short time features of the whole file
+        if stream is True:
+            st_features, features_names = self.stream_short_time_features(filename, sample_rate)
+        else:
+            audio_signal = AudioSignal(sample_rate, filename=filename, dtype=self._dtype)
+            audio_features = AudioFeatures(audio_signal, float(self._features_param.get("win_size")),
+                                           float(self._features_param.get("win_step")), dtype=self._dtype)
+            st_features, features_names = audio_features.short_time_feature_extraction(
+                self._features_param.get("features_list"), self._features_param.get("nb_mfcc"))
+
+        # Number of chunks (counted from frames in both modes: a chunk is kept when all its frames are in the file)
+        nb_chunks = (len(st_features) - nb_frames) // hop + 1 if len(st_features) >= nb_frames else 0
+
+        if nb_chunks == 0 or nb_frames <= 0:
+            return numpy.zeros((0, 0))
+
+        # Global statistics of all chunks at once
+        features, features_names = AudioFeatures.sliding_global_statistics(st_features, features_names, nb_frames, hop,
+                                                                           nb_chunks,
+                                                                           stats=self._features_param.get("stats"),
+                                                                           diff=self._features_param.get("diff"))
+        return features
+
+    '''
+    Function to extract global audio features of each chunk of a file (a single row if chunk_size is 0)
+    Features are read from the cache when the same audio content was already processed with the same parameters
+    With stream=True, the file is read block by block and the whole audio signal is never held in memory; without
+    chunks, the short-time features of the whole file are still kept for its global statistics (percentiles need every
+    frame), so memory is O(frames) rather than flat (see stream_short_time_features)
+    With sliding=True, overlapping chunks share one short-time features extraction (see extract_sliding_features);
+    chunk steps that are not a multiple of the short-time window step fall back to independent chunks
+    '''
+    def extract_features_from_file(self, filename, sample_rate, chunk_size=0, chunk_step=0, stream=False,
+                                   sliding=False):
+
+        # Look up cached features
+        if self._cache is not None:
+            param = {name: self._features_param.get(name) for name in ["win_size", "win_step", "stats",
+                                                                       "features_list", "nb_mfcc", "diff"]}
+            param.update({"sample_rate": sample_rate, "chunk_size": chunk_size, "chunk_step": chunk_step,
+                          "dtype": self._dtype.name})
+            if sliding is True:
+                param["sliding"] = True
+            key = self._cache.key(filename, param)
+            features = self._cache.get(key)
+            if features is not None:
+                return features
+
+        # Overlapping chunks sharing their short-time features
+        win_hop = int(float(self._features_param.get("win_step")) * sample_rate)
+        if chunk_size > 0 and sliding is True and int(chunk_step * sample_rate) % win_hop == 0:
+            features = self.extract_sliding_features(filename, sample_rate, chunk_size, chunk_step, stream=stream)
+
+        # Split audio signals into chunks
+        elif chunk_size > 0:
+
+            # Read chunks one at a time from the file
+            if stream is True:
+                chunks = AudioSignal.stream_audio_file(filename, sample_rate, int(chunk_size * sample_rate),
+                                                       int(chunk_step * sample_rate))
+
+            # Read the whole file and split it into chunks
+            else:
+                audio_signal = AudioSignal(sample_rate, filename=filename, dtype=self._dtype)
+                chunks, _ = audio_signal.framing(chunk_size, chunk_step, view=True)
+
+            # Features of each chunks (wrapped in a signal on demand)
+            features = [self.extract_features(AudioSignal(sample_rate, signal=chunk, dtype=self._dtype)) for chunk in chunks]
+            features = numpy.array(features) if len(features) > 0 else numpy.zeros((0, 0))
+
+        elif stream is True:
+
+            # Short time features of the file, block by block
+            st_features, features_names = self.stream_short_time_features(filename, sample_rate)
+
+            # Global statistics of the whole file
+            features, features_names = AudioFeatures.global_statistics(st_features, features_names,
+                                                                       stats=self._features_param.get("stats"),
+                                                                       diff=self._features_param.get("diff"))
+            features = features[numpy.newaxis]
+
+        else:
+
+            # Initialize Audio Basic object
+            audio_signal = AudioSignal(sample_rate, filename=filename, dtype=self._dtype)
+            features = self.extract_features(audio_signal)[numpy.newaxis]
+
+        # Store features
+        if self._cache is not None:
+            self._cache.set(key, features)
+
+        return features
 
     '''
     Function to predict speech emotion over time from video
+    With stream=True, the file is read block by block and the whole audio signal is never held in memory (memory still
+    grows with the short-time features of the file, see extract_features_from_file)
+    With sliding=True, overlapping chunks share one short-time features extraction
     '''
     def predict_emotion_from_file(self, filename, sample_rate, chunk_size=0, chunk_step=0, predict_proba=False,
-                                  decode=True):
+                                  decode=True, stream=False, sliding=False):
 
-        # Initialize Audio Basic object
-        audio_signal = AudioSignal(sample_rate, filename=filename)
+        # Extract (or get cached) audio features
+        features = self.extract_features_from_file(filename, sample_rate, chunk_size=chunk_size, chunk_step=chunk_step,
+                                                   stream=stream, sliding=sliding)
 
         # Split audio signals into chunks
         if chunk_size > 0:
-            chunks = audio_signal.framing(chunk_size, chunk_step)
 
             # Initialize time stamp
             timestamp = []
-
-            # Emotion prediction for each chunks
-            prediction = []
-            for signal in chunks:
+            for _ in range(len(features)):
                 if len(timestamp) == 0:
                     timestamp.append(chunk_size)
                 else:
                     timestamp.append(timestamp[-1] + chunk_step)
-                prediction.append(self.predict_emotion(signal, predict_proba=predict_proba, decode=decode))
+
+            # Emotion prediction for all chunks at once
+            prediction = []
+            if len(features) > 0:
+                prediction = self.predict_features_batch(features, predict_proba=predict_proba, decode=decode)
 
             # Return emotion prediction and related timestamp
             return prediction, timestamp
+
         else:
 
             # Emotion prediction
-            prediction = self.predict_emotion(audio_signal, predict_proba=predict_proba, decode=decode)
+            prediction = self.predict_features(features[0], predict_proba=predict_proba, decode=decode)
 
             # Return emotion prediction
             return prediction
+
+    '''
+    Function to open a timeline writer for the predictions of this model (probabilities columns are the classes of
+    the label encoder, gender included)
+    '''
+    def timeline_writer(self, timeline_path, probabilities=True, shard_size=100000, compress=False):
+        classes = [str(label) for label in self._encoder.classes_] if probabilities is True else None
+        return TimelineWriter(timeline_path, classes=classes, shard_size=shard_size, compress=compress)
+
+    '''
+    Function to predict speech emotion over time from a file and append the predictions to a timeline writer
+    (timestamp 0 for a whole file prediction, chunk_size=0)
+    When the writer has probabilities columns, the emotion of each chunk is its most probable class, so that both
+    columns agree (it can differ from the SVM vote of predict_emotion_from_file)
+    '''
+    def predict_emotion_to_timeline(self, writer, filename, sample_rate, chunk_size=0, chunk_step=0, stream=False,
+                                    sliding=False):
+
+        # Extract (or get cached) audio features
+        features = self.extract_features_from_file(filename, sample_rate, chunk_size=chunk_size, chunk_step=chunk_step,
+                                                   stream=stream, sliding=sliding)
+
+        # Time stamp of each chunk
+        timestamp = chunk_size + numpy.arange(len(features)) * chunk_step
+
+        # Emotions and probabilities of all chunks
+        emotions = []
+        probabilities = numpy.zeros((0, len(self._encoder.classes_))) if writer.classes is not None else None
+        if len(features) > 0 and writer.classes is not None:
+            probabilities = self.classify_features(features, predict_proba=True)
+            emotions = [row[2:] for row in self._encoder.inverse_transform(numpy.argmax(probabilities, axis=1))]
+        elif len(features) > 0:
+            emotions = self.predict_features_batch(features)
+
+        writer.append(filename, emotions, timestamp, probabilities)
+
+        return emotions, timestamp
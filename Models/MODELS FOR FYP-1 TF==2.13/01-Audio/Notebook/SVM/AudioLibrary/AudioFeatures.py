@@ -1,16 +1,27 @@
 import numpy
+from math import comb
+from functools import lru_cache
+from scipy.fft import rfft
 from scipy.fftpack.realtransforms import dct
 from scipy.stats import kurtosis, skew
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.ndimage import rank_filter
 from AudioLibrary.AudioSignal import *
 
 
 class AudioFeatures:
 
-    def __init__(self, audio_signal, win_size, win_step):
+    # Largest relative difference allowed between float32 and float64 global features (see dtype_tolerance)
+    FLOAT32_TOLERANCE = 1e-3
+
+    def __init__(self, audio_signal, win_size, win_step, dtype=None):
 
         # Audio Signal
         self._audio_signal = audio_signal
 
+        # Floating point type of short-time computations (the one of the audio signal by default)
+        self._dtype = numpy.dtype(dtype) if dtype is not None else audio_signal._dtype
+
         # Short time features window size
         self._win_size = win_size
 
@@ -19,115 +30,214 @@ class AudioFeatures:
 
     '''
     Global statistics features extraction from an audio signals
+    diff can be a single difference order or a list of orders (e.g. [0, 1, 2]) computed from the same short-time features
     '''
     def global_feature_extraction(self, stats=['mean', 'std'], features_list=[], nb_mfcc=12, nb_filter=40, diff=0, hamming=True):
 
         # Extract short term audio features
         st_features, f_names = self.short_time_feature_extraction(features_list, nb_mfcc, nb_filter, hamming)
 
-        # Number of short term features
-        nb_feats = st_features.shape[1]
+        # Aggregate short term features into global statistics
+        return self.global_statistics(st_features, f_names, stats=stats, diff=diff)
+
+    '''
+    Global statistics of a short-time features matrix (one row per frame) for one or several difference orders
+    '''
+    @classmethod
+    def global_statistics(cls, st_features, f_names, stats=['mean', 'std'], diff=0):
+
+        # Difference orders
+        diffs = [diff] if numpy.isscalar(diff) else list(diff)
+
+        features = []
+        for d in diffs:
 
-        # Number of statistics
-        nb_stats = len(stats)
+            # Compute first or second order difference of all features at once
+            feat = st_features[d:] - st_features[:-d] if d > 0 else st_features
 
-        # Global statistics feature names
-        feature_names = ["" for x in range(nb_feats * nb_stats)]
-        for i in range(nb_feats):
-            for j in range(nb_stats):
-                feature_names[i + j * nb_feats] = f_names[i] + "_d" + str(diff) + "_" + stats[j]
+            # Global statistics (one row per statistic, one column per feature)
+            features.append(cls.compute_statistics(feat, stats).flatten())
 
-        # Calculate global statistics features
-        features = numpy.zeros((nb_feats * nb_stats))
-        for i in range(nb_feats):
+        return numpy.concatenate(features), cls.global_feature_names(f_names, stats=stats, diff=diff)
 
-            # Get features series
-            feat = st_features[:, i]
+    '''
+    Global statistics of overlapping windows of a short-time features matrix (one row per window)
+    Window i covers the nb_frames frames starting at frame i * hop. The short-time features and their differences are
+    computed once over the whole matrix and shared by overlapping windows, and their statistics come from sliding
+    aggregates whose cost does not grow with the overlap; each window gets the same statistics as global_statistics
+    on its own slice.
+    '''
+    @classmethod
+    def sliding_global_statistics(cls, st_features, f_names, nb_frames, hop, nb_windows, stats=['mean', 'std'],
+                                  diff=0):
+
+        # Difference orders
+        diffs = [diff] if numpy.isscalar(diff) else list(diff)
+
+        # First frame of each window
+        starts = hop * numpy.arange(nb_windows)
 
-            # Compute first or second order difference
-            if diff > 0:
-                feat = feat[diff:] - feat[:-diff]
+        features = []
+        for d in diffs:
 
-            # Global statistics
-            for j in range(nb_stats):
-                features[i + j * nb_feats] = self.compute_statistic(feat, stats[j])
+            # Differences are computed once over the whole matrix: window i holds nb_frames - d of them
+            feat = st_features[d:] - st_features[:-d] if d > 0 else st_features
 
-        return features, feature_names
+            # Global statistics of each window (statistic major, then feature)
+            features.append(cls.compute_sliding_statistics(feat, nb_frames - d, starts, stats).reshape(nb_windows, -1))
+
+        return numpy.concatenate(features, axis=1), cls.global_feature_names(f_names, stats=stats, diff=diff)
 
     '''
-    Short-time features extraction from an audio signals
+    Names of the global statistics features (statistic major, then short-time feature, for each difference order)
     '''
-    def short_time_feature_extraction(self, features=[], nb_mfcc=12, nb_filter=40, hamming=True):
+    @staticmethod
+    def global_feature_names(f_names, stats=['mean', 'std'], diff=0):
 
-        # Copy features list to compute
-        features_list = list(features)
+        # Difference orders
+        diffs = [diff] if numpy.isscalar(diff) else list(diff)
 
-        # MFFCs features names
-        mfcc_feature_names = []
-        if 'mfcc' in features_list:
-            mfcc_feature_names = ["mfcc_{0:d}".format(i) for i in range(1, nb_mfcc + 1)]
-            features_list.remove('mfcc')
+        return [f + "_d" + str(d) + "_" + stat for d in diffs for stat in stats for f in f_names]
 
-        # Filter banks features names
-        fbank_features_names = []
-        if 'filter_banks' in features_list:
-            fbank_features_names = ["fbank_{0:d}".format(i) for i in range(1, nb_filter + 1)]
-            features_list.remove('filter_banks')
+    '''
+    Tolerance check of a reduced precision compute path (e.g. dtype=numpy.float32)
+    Returns the largest difference between the global features computed with dtype and with float64, relative to
+    |value| + scale, where scale is the frame to frame standard deviation of the short-time feature (1 for the
+    dimensionless kurt and skew). float32 global features stay within FLOAT32_TOLERANCE of float64.
+    '''
+    def dtype_tolerance(self, dtype=numpy.float32, stats=['mean', 'std'], features_list=[], nb_mfcc=12, nb_filter=40,
+                        diff=0, hamming=True):
+
+        features = []
+        for compute_dtype in [numpy.float64, dtype]:
+            audio_features = AudioFeatures(self._audio_signal, self._win_size, self._win_step, dtype=compute_dtype)
+            st_features, f_names = audio_features.short_time_feature_extraction(features_list, nb_mfcc, nb_filter,
+                                                                                hamming)
+            features.append(self.global_statistics(st_features.astype(numpy.float64), f_names, stats=stats,
+                                                   diff=diff)[0])
+
+            # Scale of each global feature
+            if compute_dtype is numpy.float64:
+                st_std = numpy.std(st_features, axis=0)
+                scale = numpy.array([1.0 if stat in ['kurt', 'skew'] else st_std[i]
+                                     for d in ([diff] if numpy.isscalar(diff) else diff)
+                                     for stat in stats for i in range(len(f_names))])
+
+        return numpy.max(numpy.abs(features[1] - features[0]) / (numpy.abs(features[0]) + scale))
+
+    '''
+    Short-time features extraction from an audio signals
+    dft_prev is the spectrum of the frame preceding the signal, when the signal continues a previous block
+    '''
+    def short_time_feature_extraction(self, features=[], nb_mfcc=12, nb_filter=40, hamming=True, dft_prev=None):
+
+        # Features computed one by one (MFCCs and Filter Banks are computed together)
+        features_list = [f for f in features if f not in ['mfcc', 'filter_banks']]
 
         # All Features names
-        feature_names = features_list + mfcc_feature_names + fbank_features_names
+        feature_names = self.short_time_feature_names(features, nb_mfcc, nb_filter)
 
         # Number of features
         nb_features = len(feature_names)
 
-        # Framming signal
-        frames = self._audio_signal.framing(self._win_size, self._win_step, hamming=hamming)
+        # Framming signal (one row per frame)
+        frames = self._audio_signal.frame_array(self._win_size, self._win_step, hamming=hamming).astype(self._dtype,
+                                                                                                        copy=False)
 
         # Number of frame
-        nb_frames = len(frames)
+        nb_frames = frames.shape[0]
 
-        # Compute features on each frame
-        features = numpy.zeros((nb_frames, nb_features))
-        cur_pos = 0
-        for el in frames:
+        # Compute the normalize magnitude of the spectrum of all frames (Discrete Fourier Transform)
+        dft = numpy.abs(rfft(frames, axis=-1)) / frames.shape[1]
 
-            # Get signal of the frame
-            signal = el._signal
+        # Return the first half of the spectrum
+        dft = dft[:, :int((self._win_size * self._audio_signal._sample_rate) / 2)]
 
-            # Compute the normalize magnitude of the spectrum (Discrete Fourier Transform)
-            dft = el.dft(norm=True)
+        # Previous Discrete Fourier Transform coefficients (the first frame is its own predecessor)
+        if dft_prev is None:
+            dft_prev = dft[0]
+        dft_prev = numpy.concatenate((dft_prev[numpy.newaxis], dft[:-1]))
 
-            # Return the first half of the spectrum
-            dft = dft[:int((self._win_size * self._audio_signal._sample_rate) / 2)]
-            if cur_pos == 0:
-                dft_prev = dft
+        # Keep last Discrete Fourier Transform coefficients for the next block
+        self._last_dft = dft[-1]
 
-            # Compute features on frame
-            for idx, f in enumerate(features_list):
-                features[cur_pos, idx] = self.compute_st_features(f, signal, dft, dft_prev,
-                                                                  self._audio_signal._sample_rate)
+        # Compute features on all frames
+        st_features = numpy.zeros((nb_frames, nb_features), dtype=self._dtype)
+        for idx, f in enumerate(features_list):
+            st_features[:, idx] = self.compute_st_features(f, frames, dft, dft_prev, self._audio_signal._sample_rate)
 
-            # Compute MFCCs and Filter Banks
-            if len(mfcc_feature_names) > 0:
-                features[cur_pos, len(features_list):len(features_list) + len(mfcc_feature_names) + len(fbank_features_names)] = self.mfcc(signal, self._audio_signal._sample_rate,
-                                                                   nb_coeff=nb_mfcc, nb_filt=nb_filter, return_fbank=len(fbank_features_names) > 0)
-            # Compute Filter Banks
-            elif len(fbank_features_names) > 0:
-                features[cur_pos, len(features_list) + len(mfcc_feature_names):] = self.filter_banks_coeff(signal, self._audio_signal._sample_rate, nb_filt=nb_filter)
+        # Compute MFCCs and Filter Banks
+        if 'mfcc' in features:
+            st_features[:, len(features_list):] = self.mfcc(frames, self._audio_signal._sample_rate, nb_coeff=nb_mfcc,
+                                                            nb_filt=nb_filter, return_fbank='filter_banks' in features)
+        # Compute Filter Banks
+        elif 'filter_banks' in features:
+            st_features[:, len(features_list):] = self.filter_banks_coeff(frames, self._audio_signal._sample_rate,
+                                                                          nb_filt=nb_filter)
 
-            # Keep previous Discrete Fourier Transform coefficients
-            dft_prev = dft
-            cur_pos = cur_pos + 1
+        return st_features, feature_names
 
-        return features, feature_names
+    '''
+    Names of the short-time features (features computed one by one, then MFCCs, then Filter Banks)
+    '''
+    @staticmethod
+    def short_time_feature_names(features=[], nb_mfcc=12, nb_filter=40):
+
+        # Features computed one by one
+        features_list = [f for f in features if f not in ['mfcc', 'filter_banks']]
+
+        # MFFCs features names
+        mfcc_feature_names = []
+        if 'mfcc' in features:
+            mfcc_feature_names = ["mfcc_{0:d}".format(i) for i in range(1, nb_mfcc + 1)]
+
+        # Filter banks features names
+        fbank_features_names = []
+        if 'filter_banks' in features:
+            fbank_features_names = ["fbank_{0:d}".format(i) for i in range(1, nb_filter + 1)]
+
+        # All Features names
+        return features_list + mfcc_feature_names + fbank_features_names
 
     '''
-    Computes zero crossing rate of a signal
+    Short-time features extraction from an audio file read block by block (see AudioSignal.stream_audio_file)
+    Yields the short-time features of each block of nb_frames_block frames, frames follow each other across blocks
+    as if the whole file had been framed at once
+    '''
+    @classmethod
+    def stream_short_time_feature_extraction(cls, filename, sample_rate, win_size, win_step, features=[], nb_mfcc=12,
+                                             nb_filter=40, hamming=True, nb_frames_block=1000, dtype=numpy.float64):
+
+        # Rescale windows step and size
+        win_size_samples = int(win_size * sample_rate)
+        win_step_samples = int(win_step * sample_rate)
+
+        # Blocks overlap by the part of the last frame not covered by the next frame
+        block_step = nb_frames_block * win_step_samples
+        block_size = block_step + win_size_samples - win_step_samples
+
+        dft_prev = None
+        for block in AudioSignal.stream_audio_file(filename, sample_rate, block_size, block_step, partial=True):
+
+            # Trailing samples shorter than a frame
+            if len(block) < win_size_samples:
+                break
+
+            # Short-time features of the block
+            audio_features = cls(AudioSignal(sample_rate, signal=block, dtype=dtype), win_size, win_step)
+            st_features, feature_names = audio_features.short_time_feature_extraction(features, nb_mfcc, nb_filter,
+                                                                                      hamming, dft_prev=dft_prev)
+            dft_prev = audio_features._last_dft
+
+            yield st_features, feature_names
+
+    '''
+    Computes zero crossing rate of a signal (or of each row of a frame matrix)
     '''
     @staticmethod
     def zcr(signal):
-        zcr = numpy.sum(numpy.abs(numpy.diff(numpy.sign(signal))))
-        zcr = zcr / (2 * numpy.float64(len(signal) - 1.0))
+        zcr = numpy.sum(numpy.abs(numpy.diff(numpy.sign(signal), axis=-1)), axis=-1)
+        zcr = zcr / (2 * (signal.shape[-1] - 1.0))
         return zcr
 
     '''
@@ -135,7 +245,7 @@ class AudioFeatures:
     '''
     @staticmethod
     def energy(signal):
-        energy = numpy.sum(signal ** 2) / numpy.float64(len(signal))
+        energy = numpy.sum(signal ** 2, axis=-1) / float(signal.shape[-1])
         return energy
 
     '''
@@ -145,21 +255,21 @@ class AudioFeatures:
     def energy_entropy(signal, n_short_blocks=10, eps=10e-8):
 
         # Total frame energy
-        energy = numpy.sum(signal ** 2)
-        sub_win_len = int(numpy.floor(len(signal) / n_short_blocks))
+        energy = numpy.sum(signal ** 2, axis=-1)
+        sub_win_len = int(numpy.floor(signal.shape[-1] / n_short_blocks))
 
         # Length of sub-frame
-        if len(signal) != sub_win_len * n_short_blocks:
-            signal = signal[0:sub_win_len * n_short_blocks]
+        if signal.shape[-1] != sub_win_len * n_short_blocks:
+            signal = signal[..., 0:sub_win_len * n_short_blocks]
 
-        # Get sub windows
-        sub_wins = signal.reshape(sub_win_len, n_short_blocks, order='F').copy()
+        # Get sub windows (one row per sub-frame)
+        sub_wins = signal.reshape(signal.shape[:-1] + (n_short_blocks, sub_win_len))
 
         # Compute normalized sub-frame energies:
-        sub_energies = numpy.sum(sub_wins ** 2, axis=0) / (energy + eps)
+        sub_energies = numpy.sum(sub_wins ** 2, axis=-1) / (numpy.expand_dims(energy, -1) + eps)
 
         # Compute entropy of the normalized sub-frame energies:
-        entropy = -numpy.sum(sub_energies * numpy.log2(sub_energies + eps))
+        entropy = -numpy.sum(sub_energies * numpy.log2(sub_energies + eps), axis=-1)
 
         return entropy
 
@@ -170,20 +280,21 @@ class AudioFeatures:
     def spectral_centroid_spread(fft, fs, eps=10e-8):
 
         # Sample range
-        sr = (numpy.arange(1, len(fft) + 1)) * (fs / (2.0 * len(fft)))
+        sr = ((numpy.arange(1, fft.shape[-1] + 1)) * (fs / (2.0 * fft.shape[-1]))).astype(fft.dtype)
 
         # Normalize fft coefficients by the max value
-        norm_fft = fft / (fft.max() + eps)
+        norm_fft = fft / (fft.max(axis=-1, keepdims=True) + eps)
+        sum_norm_fft = numpy.sum(norm_fft, axis=-1, keepdims=True) + eps
 
         # Centroid:
-        C = numpy.sum(sr * norm_fft) / (numpy.sum(norm_fft) + eps)
+        C = numpy.sum(sr * norm_fft, axis=-1, keepdims=True) / sum_norm_fft
 
         # Spread:
-        S = numpy.sqrt(numpy.sum(((sr - C) ** 2) * norm_fft) / (numpy.sum(norm_fft) + eps))
+        S = numpy.sqrt(numpy.sum(((sr - C) ** 2) * norm_fft, axis=-1, keepdims=True) / sum_norm_fft)
 
         # Normalize:
-        C = C / (fs / 2.0)
-        S = S / (fs / 2.0)
+        C = C[..., 0] / (fs / 2.0)
+        S = S[..., 0] / (fs / 2.0)
 
         return C, S
 
@@ -194,13 +305,13 @@ class AudioFeatures:
     def spectral_flux(fft, fft_prev, eps=10e-8):
 
         # Sum of fft coefficients
-        sum_fft = numpy.sum(fft + eps)
+        sum_fft = numpy.sum(fft + eps, axis=-1, keepdims=True)
 
         # Sum of previous fft coefficients
-        sum_fft_prev = numpy.sum(fft_prev + eps)
+        sum_fft_prev = numpy.sum(fft_prev + eps, axis=-1, keepdims=True)
 
         # Compute the spectral flux as the sum of square distances
-        flux = numpy.sum((fft / sum_fft - fft_prev / sum_fft_prev) ** 2)
+        flux = numpy.sum((fft / sum_fft - fft_prev / sum_fft_prev) ** 2, axis=-1)
 
         return flux
 
@@ -211,39 +322,32 @@ class AudioFeatures:
     def spectral_rolloff(fft, c=0.90, eps=10e-8):
 
         # Total energy
-        energy = numpy.sum(fft ** 2)
+        energy = numpy.sum(fft ** 2, axis=-1, keepdims=True)
 
         # Roll off threshold
         threshold = c * energy
 
         # Compute cumulative energy
-        cum_energy = numpy.cumsum(fft ** 2) + eps
+        cum_energy = numpy.cumsum(fft ** 2, axis=-1) + eps
 
-        # Find the spectral roll off as the frequency position
-        [roll_off, ] = numpy.nonzero(cum_energy > threshold)
+        # Find the spectral roll off as the first frequency position above the threshold
+        above = cum_energy > threshold
+        roll_off = numpy.argmax(above, axis=-1)
 
-        # Normalize
-        if len(roll_off) > 0:
-            roll_off = numpy.float64(roll_off[0]) / (float(len(fft)))
-        else:
-            roll_off = 0.0
+        # Normalize (zero when the threshold is never reached)
+        roll_off = numpy.where(numpy.any(above, axis=-1), roll_off / float(fft.shape[-1]), 0.0)
 
         return roll_off
 
     '''
-    Computes the Filter Bank coefficients
+    Builds the triangular Mel filter bank matrix (cached per sample rate, number of filters and FFT size)
     '''
     @staticmethod
-    def filter_banks_coeff(signal, sample_rate, nb_filt=40, nb_fft=512):
-
-        # Magnitude of the FFT
-        mag_frames = numpy.absolute(numpy.fft.rfft(signal, nb_fft))
-
-        # Power Spectrum
-        pow_frames = ((1.0 / nb_fft) * (mag_frames ** 2))
-        low_freq_mel = 0
+    @lru_cache(maxsize=16)
+    def mel_filter_bank(sample_rate, nb_filt=40, nb_fft=512, dtype=numpy.float64):
 
         # Convert Hz to Mel
+        low_freq_mel = 0
         high_freq_mel = (2595 * numpy.log10(1 + (sample_rate / 2) / 700))
 
         # Equally spaced in Mel scale
@@ -253,27 +357,62 @@ class AudioFeatures:
         hz_points = (700 * (10 ** (mel_points / 2595) - 1))
         bin = numpy.floor((nb_fft + 1) * hz_points / sample_rate)
 
-        # Calculate filter banks
-        fbank = numpy.zeros((nb_filt, int(numpy.floor(nb_fft / 2 + 1))))
-        for m in range(1, nb_filt + 1):
+        # Left, center and right bins of each filter
+        left = bin[:-2, numpy.newaxis]
+        center = bin[1:-1, numpy.newaxis]
+        right = bin[2:, numpy.newaxis]
+
+        # FFT bins
+        k = numpy.arange(int(numpy.floor(nb_fft / 2 + 1)))[numpy.newaxis, :]
+
+        # Rising and falling edges of each triangular filter
+        rising = (k >= left) & (k < center)
+        falling = (k >= center) & (k < right)
+        fbank = numpy.zeros((nb_filt, k.shape[1]))
+        fbank = numpy.where(rising, (k - left) / numpy.where(center > left, center - left, 1), fbank)
+        fbank = numpy.where(falling, (right - k) / numpy.where(right > center, right - center, 1), fbank)
+
+        # Shared between calls: make it read-only
+        fbank = fbank.astype(dtype)
+        fbank.setflags(write=False)
+
+        return fbank
+
+    '''
+    Builds the orthonormal DCT-II basis keeping coefficients 1 to nb_coeff (cached per filter bank size)
+    '''
+    @staticmethod
+    @lru_cache(maxsize=16)
+    def dct_basis(nb_filt=40, nb_coeff=12, dtype=numpy.float64):
+
+        # DCT of the identity gives the transform matrix (one column per coefficient)
+        basis = dct(numpy.eye(nb_filt), type=2, axis=-1, norm='ortho')[:, 1: (nb_coeff + 1)].astype(dtype)
+
+        # Shared between calls: make it read-only
+        basis.setflags(write=False)
 
-            # left
-            f_m_minus = int(bin[m - 1])
+        return basis
 
-            # center
-            f_m = int(bin[m])
+    '''
+    Computes the Filter Bank coefficients
+    '''
+    @classmethod
+    def filter_banks_coeff(cls, signal, sample_rate, nb_filt=40, nb_fft=512):
+
+        # Floating point type of computations (float64 for integer samples)
+        dtype = signal.dtype if numpy.issubdtype(signal.dtype, numpy.floating) else numpy.dtype(numpy.float64)
 
-            # right
-            f_m_plus = int(bin[m + 1])
+        # Magnitude of the FFT
+        mag_frames = numpy.absolute(rfft(numpy.asarray(signal, dtype=dtype), nb_fft, axis=-1))
+
+        # Power Spectrum
+        pow_frames = ((1.0 / nb_fft) * (mag_frames ** 2))
 
-            for k in range(f_m_minus, f_m):
-                fbank[m - 1, k] = (k - bin[m - 1]) / (bin[m] - bin[m - 1])
-            for k in range(f_m, f_m_plus):
-                fbank[m - 1, k] = (bin[m + 1] - k) / (bin[m + 1] - bin[m])
-        filter_banks = numpy.dot(pow_frames, fbank.T)
+        # Apply the cached filter banks to all frames at once
+        filter_banks = numpy.dot(pow_frames, cls.mel_filter_bank(sample_rate, nb_filt, nb_fft, dtype).T)
 
         # Numerical Stability
-        filter_banks = numpy.where(filter_banks == 0, numpy.finfo(float).eps, filter_banks)
+        filter_banks = numpy.where(filter_banks == 0, numpy.finfo(float).eps, filter_banks).astype(dtype, copy=False)
 
         # dB
         filter_banks = 20 * numpy.log10(filter_banks)
@@ -288,12 +427,12 @@ class AudioFeatures:
         # Apply filter bank on spectogram
         filter_banks = self.filter_banks_coeff(signal, sample_rate, nb_filt=nb_filt, nb_fft=nb_fft)
 
-        # Compute MFCC coefficients
-        mfcc = dct(filter_banks, type=2, axis=-1, norm='ortho')[1: (nb_coeff + 1)]
+        # Compute MFCC coefficients with the cached DCT basis
+        mfcc = numpy.dot(filter_banks, self.dct_basis(nb_filt, nb_coeff, filter_banks.dtype))
 
         # Return MFFCs and Filter banks coefficients
         if return_fbank is True:
-            return numpy.concatenate((mfcc, filter_banks))
+            return numpy.concatenate((mfcc, filter_banks), axis=-1)
         else:
             return mfcc
 
@@ -324,6 +463,219 @@ class AudioFeatures:
             S = numpy.abs(numpy.percentile(seq, 99) - numpy.percentile(seq, 1))
         return S
 
+    '''
+    Compute statistics on each column of a short time features matrix
+    Percentile based statistics (med, q1, q99, range) share a single partial sort per column
+    '''
+    @classmethod
+    def compute_statistics(cls, seq, stats):
+
+        # Percentiles needed by the requested statistics
+        percentiles = {'med': [50], 'q1': [1], 'q99': [99], 'range': [1, 99]}
+        q = sorted(set(p for stat in stats for p in percentiles.get(stat, [])))
+        if len(q) > 0:
+            q_values = dict(zip(q, cls.compute_percentiles(seq, q)))
+
+        S = numpy.zeros((len(stats),) + seq.shape[1:])
+        for j, statistic in enumerate(stats):
+            if statistic == 'mean':
+                S[j] = numpy.mean(seq, axis=0)
+            elif statistic == 'med':
+                S[j] = q_values[50]
+            elif statistic == 'std':
+                S[j] = numpy.std(seq, axis=0)
+            elif statistic == 'kurt':
+                S[j] = kurtosis(seq, axis=0)
+            elif statistic == 'skew':
+                S[j] = skew(seq, axis=0)
+            elif statistic == 'min':
+                S[j] = numpy.min(seq, axis=0)
+            elif statistic == 'max':
+                S[j] = numpy.max(seq, axis=0)
+            elif statistic == 'q1':
+                S[j] = q_values[1]
+            elif statistic == 'q99':
+                S[j] = q_values[99]
+            elif statistic == 'range':
+                S[j] = numpy.abs(q_values[99] - q_values[1])
+        return S
+
+    '''
+    Compute several percentiles (linear interpolation) along the first axis with one partial sort
+    '''
+    @staticmethod
+    def compute_percentiles(seq, q):
+
+        # Position of each percentile in the sorted columns
+        nb_rows = seq.shape[0]
+        position = numpy.asarray(q, dtype=float) / 100.0 * (nb_rows - 1)
+        lower = numpy.floor(position).astype(int)
+        upper = numpy.minimum(lower + 1, nb_rows - 1)
+
+        # Partial sort placing only the needed order statistics
+        part = numpy.partition(seq, numpy.unique(numpy.concatenate((lower, upper))), axis=0)
+
+        # Linear interpolation between neighbouring order statistics
+        weight = (position - lower).reshape((-1,) + (1,) * (seq.ndim - 1))
+        return part[lower] + (part[upper] - part[lower]) * weight
+
+    '''
+    Compute statistics of the windows seq[start:start + length] of each column, for each start of starts
+    Returns one matrix per window (one row per statistic, one column per feature), as compute_statistics does
+    - mean, std, kurt and skew: block power sums (see sliding_moments), linear in the number of rows; windows whose
+      moments would lose precision are computed directly (compute_statistics on a strided view of these windows)
+    - min and max: block prefix / suffix extrema (van Herk / Gil-Werman), linear in the number of rows
+    - percentiles: rolling order statistics of each column (see sliding_percentiles)
+    '''
+    @classmethod
+    def compute_sliding_statistics(cls, seq, length, starts, stats):
+
+        S = numpy.zeros((len(starts), len(stats), seq.shape[1]))
+
+        # Moments of each window, and windows to compute directly
+        moment_stats = [j for j, stat in enumerate(stats) if stat in ['mean', 'std', 'skew', 'kurt']]
+        if len(moment_stats) > 0:
+            order = max([{'mean': 1, 'std': 2, 'skew': 3, 'kurt': 4}[stats[j]] for j in moment_stats])
+            mean, moments, unstable = cls.sliding_moments(seq, length, starts, order)
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                for j in moment_stats:
+                    if stats[j] == 'mean':
+                        S[:, j] = mean
+                    elif stats[j] == 'std':
+                        S[:, j] = numpy.sqrt(moments[2])
+                    elif stats[j] == 'skew':
+                        S[:, j] = moments[3] / moments[2] ** 1.5
+                    elif stats[j] == 'kurt':
+                        S[:, j] = moments[4] / moments[2] ** 2 - 3.0
+
+            # Direct computation of the windows without enough precision (e.g. a pause in a loud block)
+            rows = numpy.flatnonzero(unstable.any(axis=1))
+            if len(rows) > 0:
+                windows = numpy.moveaxis(sliding_window_view(seq, length, axis=0)[starts[rows]], -1, 0)
+                S[rows[:, numpy.newaxis], moment_stats] = numpy.moveaxis(
+                    cls.compute_statistics(windows, [stats[j] for j in moment_stats]), 0, 1)
+
+        # Extrema of each window
+        if 'min' in stats:
+            S[:, stats.index('min')] = cls.sliding_extrema(seq, length, starts, numpy.minimum)
+        if 'max' in stats:
+            S[:, stats.index('max')] = cls.sliding_extrema(seq, length, starts, numpy.maximum)
+
+        # Percentiles of each window
+        percentiles = {'med': [50], 'q1': [1], 'q99': [99], 'range': [1, 99]}
+        q = sorted(set(p for stat in stats for p in percentiles.get(stat, [])))
+        if len(q) > 0:
+            q_values = dict(zip(q, cls.sliding_percentiles(seq, length, starts, q)))
+            for j, statistic in enumerate(stats):
+                if statistic == 'med':
+                    S[:, j] = q_values[50]
+                elif statistic == 'q1':
+                    S[:, j] = q_values[1]
+                elif statistic == 'q99':
+                    S[:, j] = q_values[99]
+                elif statistic == 'range':
+                    S[:, j] = numpy.abs(q_values[99] - q_values[1])
+        return S
+
+    '''
+    Mean and central moments (2 to order) of the windows seq[start:start + length] of each column
+    Rows are split into blocks of length rows, and every window is a block suffix plus the next block prefix. Power
+    sums of these parts are prefix / suffix sums of the rows centered on the mean of their block, moved to the mean of
+    each window (binomial expansion). Returns the means, the central moments by order, and the windows (and columns)
+    whose moments lose precision: spread around the block means far above the spread of the window, or no spread at
+    all (where scipy returns NaN skewness and kurtosis)
+    '''
+    @staticmethod
+    def sliding_moments(seq, length, starts, order, max_spread_ratio=100.0):
+
+        # Blocks of length rows centered on their mean (the padding stays 0 and is never part of a window)
+        x = numpy.asarray(seq, dtype=numpy.float64)
+        nb_rows, nb_columns = x.shape
+        nb_blocks = -(-nb_rows // length)
+        blocks = numpy.zeros((nb_blocks * length, nb_columns))
+        blocks[:nb_rows] = x
+        blocks = blocks.reshape(nb_blocks, length, nb_columns)
+        counts = numpy.minimum(length, nb_rows - length * numpy.arange(nb_blocks))
+        center = blocks.sum(axis=1) / counts[:, numpy.newaxis]
+        blocks -= center[:, numpy.newaxis]
+        blocks.reshape(-1, nb_columns)[nb_rows:] = 0.0
+
+        # Parts of each window: rows offset.. of block, then rows ..offset - 1 of the next block
+        block, offset = starts // length, starts % length
+        next_block = numpy.minimum(block + 1, nb_blocks - 1)
+        size = [(length - offset)[:, numpy.newaxis], offset[:, numpy.newaxis]]
+        part_center = [center[block], numpy.where(offset[:, numpy.newaxis] > 0, center[next_block], 0.0)]
+
+        # Power sums of each part around its block mean (the 0th power sum is the number of rows)
+        sums = [[size[0].astype(numpy.float64)], [size[1].astype(numpy.float64)]]
+        power = numpy.ones_like(blocks)
+        for _ in range(max(order, 2)):
+            power *= blocks
+            sums[0].append(numpy.cumsum(power[:, ::-1], axis=1)[:, ::-1][block, offset])
+            prefix = numpy.cumsum(power, axis=1)[next_block, offset - 1]
+            sums[1].append(numpy.where(offset[:, numpy.newaxis] > 0, prefix, 0.0))
+
+        # Mean of each window
+        mean = sum(sums[p][1] + size[p] * part_center[p] for p in range(2)) / length
+
+        # Central moments of each window, from the power sums of each part around its block mean
+        moments = {}
+        delta = [part_center[p] - mean for p in range(2)]
+        for k in range(2, max(order, 2) + 1):
+            moments[k] = sum(comb(k, i) * delta[p] ** (k - i) * sums[p][i]
+                             for p in range(2) for i in range(k + 1)) / length
+
+        # Windows without enough precision
+        spread = sum(sums[p][2] + size[p] * delta[p] ** 2 for p in range(2)) / length
+        eps = 1000 * numpy.finfo(numpy.float64).eps
+        unstable = ~((spread < max_spread_ratio * moments[2]) & (moments[2] > (eps * mean) ** 2))
+
+        return mean, moments, unstable
+
+    '''
+    Percentiles (linear interpolation, as compute_percentiles) of the windows seq[start:start + length] of each
+    column, from the rolling order statistics of each column (scipy.ndimage.rank_filter, O(log length) per row with
+    the 1D rank filter of scipy >= 1.15)
+    '''
+    @staticmethod
+    def sliding_percentiles(seq, length, starts, q):
+
+        # Order statistics around each percentile
+        position = numpy.asarray(q, dtype=float) / 100.0 * (length - 1)
+        lower = numpy.floor(position).astype(int)
+        upper = numpy.minimum(lower + 1, length - 1)
+
+        # Rolling order statistics of each column (window starting at each row)
+        order_stats = {}
+        for rank in numpy.unique(numpy.concatenate((lower, upper))):
+            order_stats[rank] = numpy.stack([rank_filter(seq[:, j], rank=int(rank), size=length,
+                                                         origin=-(length // 2))[starts]
+                                             for j in range(seq.shape[1])], axis=-1)
+
+        # Linear interpolation between neighbouring order statistics
+        return numpy.array([order_stats[l] + (order_stats[u] - order_stats[l]) * (p - l)
+                            for p, l, u in zip(position, lower, upper)])
+
+    '''
+    Running extremum (function is numpy.minimum or numpy.maximum) of the windows seq[start:start + length] of each
+    column: every window spans at most two blocks of length rows, and is the extremum of a block suffix and of the
+    next block prefix
+    '''
+    @staticmethod
+    def sliding_extrema(seq, length, starts, function):
+
+        # Blocks of length rows (the padding is never part of a window)
+        nb_blocks = -(-seq.shape[0] // length)
+        blocks = numpy.zeros((nb_blocks * length, seq.shape[1]), dtype=seq.dtype)
+        blocks[:seq.shape[0]] = seq
+        blocks = blocks.reshape(nb_blocks, length, seq.shape[1])
+
+        # Prefix and suffix extrema of each block
+        prefix = function.accumulate(blocks, axis=1).reshape(-1, seq.shape[1])
+        suffix = function.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(-1, seq.shape[1])
+
+        return function(suffix[starts], prefix[starts + length - 1])
+
     '''
     Compute short time features on signal
     '''
@@ -0,0 +1,108 @@
+import os
+import json
+import hashlib
+import tempfile
+import numpy
+
+
+class FeatureCache:
+
+    def __init__(self, cache_path, max_size=1 << 30):
+
+        # Cache directory
+        self._cache_path = cache_path
+        os.makedirs(cache_path, exist_ok=True)
+
+        # Maximum size of the cache (bytes)
+        self._max_size = max_size
+
+    '''
+    Function to build the key of an audio file: hash of the file content and of the features parameters
+    '''
+    @staticmethod
+    def key(filename, param, block_size=1 << 20):
+
+        # Hash audio content
+        content_hash = hashlib.blake2b(digest_size=20)
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                content_hash.update(block)
+
+        # Hash features parameters
+        key_hash = hashlib.blake2b(content_hash.digest(), digest_size=20)
+        key_hash.update(json.dumps(param, sort_keys=True, default=str).encode())
+
+        return key_hash.hexdigest()
+
+    '''
+    Function to get the features matrix (one row per chunk) stored for a key (None if missing)
+    '''
+    def get(self, key):
+        path = os.path.join(self._cache_path, key + '.npy')
+        try:
+            features = numpy.load(path)
+        except (IOError, ValueError, EOFError):
+            return None
+
+        # Mark as recently used
+        os.utime(path)
+
+        return features
+
+    '''
+    Function to store the features matrix of a key, then evict least recently used entries above the maximum size
+    '''
+    def set(self, key, features):
+
+        # Write to a temporary file then move it, so that readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self._cache_path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            numpy.save(f, numpy.asarray(features))
+        os.replace(tmp_path, os.path.join(self._cache_path, key + '.npy'))
+
+        # Keep cache under its maximum size
+        self.evict()
+
+    '''
+    Function to delete the features of a key
+    '''
+    def delete(self, key):
+        try:
+            os.remove(os.path.join(self._cache_path, key + '.npy'))
+            return True
+        except FileNotFoundError:
+            return False
+
+    '''
+    Function to remove least recently used entries until the cache fits in its maximum size
+    '''
+    def evict(self):
+
+        # Cached entries (last use time, size, path)
+        entries = []
+        for name in os.listdir(self._cache_path):
+            if name.endswith('.npy'):
+                try:
+                    stat = os.stat(os.path.join(self._cache_path, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(self._cache_path, name)))
+
+        # Remove oldest entries first
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self._max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size = total_size - size
+
+    '''
+    Function to remove all cached features
+    '''
+    def clear(self):
+        for name in os.listdir(self._cache_path):
+            if name.endswith('.npy'):
+                os.remove(os.path.join(self._cache_path, name))
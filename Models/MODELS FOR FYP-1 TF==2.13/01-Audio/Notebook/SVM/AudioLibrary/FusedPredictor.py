@@ -0,0 +1,154 @@
+import numpy
+from scipy.special import expit
+
+
+class FusedPredictor:
+
+    # Kernels evaluated by the predictor
+    KERNELS = ['linear', 'poly', 'rbf', 'sigmoid']
+
+    # Bounds of the pairwise class probabilities (libsvm min_prob)
+    MIN_PROB = 1e-7
+
+    '''
+    Scaler, PCA and SVM (sklearn SVC) folded into a few matrix operations, applied to many feature rows at once
+    Raises ValueError for models it cannot reproduce (sparse or precomputed kernels, break_ties=True)
+    '''
+    def __init__(self, features_mean, features_std, clf, pca=None):
+
+        if getattr(clf, '_sparse', False) or clf.kernel not in self.KERNELS:
+            raise ValueError("Error: {} kernel SVM cannot be fused.".format(clf.kernel))
+        if clf.break_ties is True and len(clf.classes_) > 2:
+            raise ValueError("Error: SVM with break_ties=True cannot be fused.")
+
+        # Fold scaling into PCA projection: (x - mean) / std - pca_mean) @ components.T = x @ W + b
+        features_mean = numpy.asarray(features_mean, dtype=numpy.float64)
+        features_std = numpy.asarray(features_std, dtype=numpy.float64)
+        if pca is not None:
+            components = numpy.asarray(pca.components_, dtype=numpy.float64)
+            if pca.whiten:
+                components = components / numpy.sqrt(pca.explained_variance_)[:, numpy.newaxis]
+            self._weight = numpy.ascontiguousarray((components / features_std).T)
+            self._bias = -(features_mean / features_std + pca.mean_) @ components.T
+        else:
+            self._weight = numpy.diag(1.0 / features_std)
+            self._bias = -features_mean / features_std
+
+        # Kernel parameters
+        self._kernel = clf.kernel
+        self._gamma = float(clf._gamma)
+        self._coef0 = float(clf.coef0)
+        self._degree = clf.degree
+        self._support_vectors = numpy.ascontiguousarray(clf.support_vectors_, dtype=numpy.float64)
+        self._sv_norm = numpy.einsum('ij,ij->i', self._support_vectors, self._support_vectors)
+
+        # One-vs-one pairs (i, j), i < j, in libsvm order
+        nb_classes = len(clf.classes_)
+        self._pairs = [(i, j) for i in range(nb_classes) for j in range(i + 1, nb_classes)]
+
+        # Dual coefficients of every pair as one (support vectors x pairs) matrix
+        starts = numpy.concatenate(([0], numpy.cumsum(clf._n_support)))
+        self._coef = numpy.zeros((len(self._support_vectors), len(self._pairs)))
+        for p, (i, j) in enumerate(self._pairs):
+            self._coef[starts[i]:starts[i + 1], p] = clf._dual_coef_[j - 1, starts[i]:starts[i + 1]]
+            self._coef[starts[j]:starts[j + 1], p] = clf._dual_coef_[i, starts[j]:starts[j + 1]]
+        self._intercept = numpy.asarray(clf._intercept_, dtype=numpy.float64)
+
+        # Platt scaling parameters of each pair (None without probability estimates)
+        self._prob_a = numpy.asarray(clf._probA, dtype=numpy.float64) if clf.probability else None
+        self._prob_b = numpy.asarray(clf._probB, dtype=numpy.float64) if clf.probability else None
+
+        self._classes = clf.classes_
+        self._nb_classes = nb_classes
+
+    '''
+    Scaled and projected features (one row per input row)
+    '''
+    def transform(self, features):
+        return numpy.asarray(features, dtype=numpy.float64) @ self._weight + self._bias
+
+    '''
+    Kernel between projected features rows and support vectors
+    '''
+    def kernel(self, X):
+        dot = X @ self._support_vectors.T
+        if self._kernel == 'linear':
+            return dot
+        elif self._kernel == 'poly':
+            return (self._gamma * dot + self._coef0) ** self._degree
+        elif self._kernel == 'sigmoid':
+            return numpy.tanh(self._gamma * dot + self._coef0)
+
+        # RBF: ||x - sv||^2 = ||x||^2 + ||sv||^2 - 2 x.sv
+        distance = numpy.einsum('ij,ij->i', X, X)[:, numpy.newaxis] + self._sv_norm - 2 * dot
+        return numpy.exp(-self._gamma * numpy.maximum(distance, 0.0))
+
+    '''
+    One-vs-one decision values (one column per pair of classes, libsvm order)
+    '''
+    def decision_function(self, features):
+        return self.kernel(self.transform(features)) @ self._coef + self._intercept
+
+    '''
+    Predicted class of each row (one-vs-one vote, ties to the first class as libsvm)
+    '''
+    def predict(self, features):
+        decision = self.decision_function(features)
+        votes = numpy.zeros((len(decision), self._nb_classes), dtype=int)
+        for p, (i, j) in enumerate(self._pairs):
+            votes[:, i] += decision[:, p] > 0
+            votes[:, j] += decision[:, p] <= 0
+        return self._classes[numpy.argmax(votes, axis=1)]
+
+    '''
+    Class probabilities of each row: Platt scaling of each pair then pairwise coupling, as libsvm
+    '''
+    def predict_proba(self, features):
+        if self._prob_a is None:
+            raise ValueError("Error: predict_proba is not available when the SVM is trained without probability.")
+
+        # Pairwise probabilities r[:, i, j] that i beats j
+        decision = self.decision_function(features)
+        pairwise = numpy.clip(expit(-(decision * self._prob_a + self._prob_b)), self.MIN_PROB, 1 - self.MIN_PROB)
+        r = numpy.zeros((len(decision), self._nb_classes, self._nb_classes))
+        for p, (i, j) in enumerate(self._pairs):
+            r[:, i, j] = pairwise[:, p]
+            r[:, j, i] = 1 - pairwise[:, p]
+
+        # Coupling (sklearn's libsvm couples two classes as well)
+        return self.pairwise_coupling(r)
+
+    '''
+    Multi-class probabilities from pairwise probabilities (Wu, Lin and Weng, method 2, as libsvm), all rows at once
+    Rows stop iterating as soon as they converge, so that each row gets the same result as alone
+    '''
+    @staticmethod
+    def pairwise_coupling(r):
+
+        nb_rows, k = r.shape[:2]
+
+        # Q[t, t] = sum_j r[j, t]^2, Q[t, j] = -r[j, t] r[t, j]
+        Q = -numpy.swapaxes(r, 1, 2) * r
+        diagonal = numpy.sum(numpy.swapaxes(r, 1, 2) ** 2, axis=2)
+        Q[:, numpy.arange(k), numpy.arange(k)] = diagonal
+
+        p = numpy.full((nb_rows, k), 1.0 / k)
+        active = numpy.ones(nb_rows, dtype=bool)
+        for _ in range(max(100, k)):
+
+            # Stopping condition
+            Qp = numpy.einsum('ntj,nj->nt', Q, p)
+            pQp = numpy.einsum('nt,nt->n', p, Qp)
+            active &= numpy.max(numpy.abs(Qp - pQp[:, numpy.newaxis]), axis=1) >= 0.005 / k
+            if not active.any():
+                break
+
+            # Coordinate updates (converged rows are left unchanged)
+            for t in range(k):
+                diff = numpy.where(active, (pQp - Qp[:, t]) / diagonal[:, t], 0.0)
+                p[:, t] += diff
+                pQp = (pQp + diff * (diff * diagonal[:, t] + 2 * Qp[:, t])) / (1 + diff) / (1 + diff)
+                Qp = (Qp + diff[:, numpy.newaxis] * Q[:, t]) / (1 + diff)[:, numpy.newaxis]
+                p /= (1 + diff)[:, numpy.newaxis]
+
+        return p
@@ -0,0 +1,77 @@
+import warnings
+import unittest
+import numpy
+from sklearn.svm import SVC
+from sklearn.decomposition import PCA
+from AudioLibrary.FusedPredictor import *
+
+
+'''
+Fused scaler, PCA and SVM checked against the sklearn estimators they are folded from
+
+    python -m unittest AudioLibrary.test_FusedPredictor
+'''
+
+
+class TestFusedPredictor(unittest.TestCase):
+
+    '''
+    Function to fit a scaler (mean, std), a PCA and an SVC on random features of nb_classes separable classes, and
+    return them with the features and the sklearn reference pipeline
+    '''
+    def fit_model(self, nb_classes=4, probability=True, kernel='rbf', pca=True, whiten=False):
+
+        rng = numpy.random.default_rng(nb_classes)
+        labels = numpy.arange(200) % nb_classes
+        features = rng.standard_normal((200, 12)) * rng.uniform(0.5, 20.0, 12) + rng.uniform(-5.0, 5.0, 12)
+        features[:, :3] += 2.0 * labels[:, numpy.newaxis]
+
+        features_mean, features_std = features.mean(axis=0), features.std(axis=0)
+        scaled = (features - features_mean) / features_std
+        projection = PCA(n_components=6, whiten=whiten).fit(scaled) if pca is True else None
+        reduced = projection.transform(scaled) if pca is True else scaled
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', FutureWarning)  # SVC probability is deprecated in recent sklearn
+            clf = SVC(kernel=kernel, probability=probability, random_state=0).fit(reduced, labels)
+
+        return features, reduced, features_mean, features_std, projection, clf
+
+    '''
+    Function to compare the fused predictor with sklearn (classes, decision values and probabilities)
+    '''
+    def assert_matches_sklearn(self, **kwargs):
+
+        features, reduced, features_mean, features_std, projection, clf = self.fit_model(**kwargs)
+        predictor = FusedPredictor(features_mean, features_std, clf, pca=projection)
+
+        numpy.testing.assert_allclose(predictor.transform(features), reduced, rtol=1e-10, atol=1e-10)
+        numpy.testing.assert_array_equal(predictor.predict(features), clf.predict(reduced))
+        if clf.probability:
+            numpy.testing.assert_allclose(predictor.predict_proba(features), clf.predict_proba(reduced),
+                                          rtol=1e-9, atol=1e-12)
+        else:
+            with self.assertRaises(ValueError):
+                predictor.predict_proba(features)
+
+    def test_scaler_pca_svc_probability(self):
+        self.assert_matches_sklearn(probability=True)
+
+    def test_scaler_pca_svc_without_probability(self):
+        self.assert_matches_sklearn(probability=False)
+
+    def test_kernels(self):
+        for kernel in FusedPredictor.KERNELS:
+            with self.subTest(kernel=kernel):
+                self.assert_matches_sklearn(kernel=kernel)
+
+    def test_whiten_and_no_pca(self):
+        self.assert_matches_sklearn(whiten=True)
+        self.assert_matches_sklearn(pca=False)
+
+    def test_two_classes(self):
+        self.assert_matches_sklearn(nb_classes=2, probability=True)
+        self.assert_matches_sklearn(nb_classes=2, probability=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,247 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from SpeechEmotionRecognition import *
+from TimelineWriter import *
+
+
+'''
+Speech emotion batch scoring
+
+Score every audio file of a directory, or of a manifest (one audio file per line, relative to the manifest directory):
+
+    python SpeechEmotionBatch.py MODEL_CNN_LSTM.hdf5 ../Datas/Recordings ../Datas/Scores --workers 4
+    python SpeechEmotionBatch.py MODEL_CNN_LSTM.hdf5 recordings.txt ../Datas/Scores
+
+A pool of processes decodes the files and computes the time distributed log-mel spectrograms of their chunks. The
+main process alone owns the model (a warm speechEmotionSession) and scores the files in the order they are ready; at
+most queue_size files are decoded ahead of the model, which bounds memory. Each file gets its own CSV in the output
+directory (timestamp, emotion and the probability of every emotion of each chunk), written to a temporary file then
+moved as soon as the file is scored. With --output-format timeline, all files are appended instead to the columnar
+shards of output/timeline (see TimelineWriter), shard_size rows at a time.
+
+Running the same command again skips the files already scored (and retries the failures listed in failures.txt).
+With timelines, files without any chunk and files whose rows were still buffered when a run stopped are scored
+again.
+'''
+
+# Audio file extensions
+AUDIO_EXTENSIONS = ['.wav', '.mp3', '.flac', '.ogg', '.m4a', '.mp4']
+
+# Recognition object (no model) and parameters of the worker processes
+_worker_recognition = None
+_worker_param = None
+
+
+'''
+Function to list the audio files of a directory (sorted, relative to the directory)
+'''
+def list_directory(directory):
+    files = []
+    for root, dirs, names in os.walk(directory):
+        dirs.sort()
+        for name in sorted(names):
+            if os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS:
+                files.append(os.path.relpath(os.path.join(root, name), directory))
+    return files
+
+
+'''
+Function to read a manifest: one audio file per line (empty lines and lines starting with # are skipped)
+'''
+def read_manifest(manifest):
+    with open(manifest) as f:
+        return [line.strip() for line in f if line.strip() != '' and not line.strip().startswith('#')]
+
+
+'''
+Function to list the audio files of a directory or manifest: root directory and file names relative to it
+'''
+def list_files(source):
+    if os.path.isdir(source):
+        return source, list_directory(source)
+    return os.path.dirname(os.path.abspath(source)), read_manifest(source)
+
+
+'''
+Function to build the output CSV file name of an audio file (kept inside the output directory)
+'''
+def output_filename(output_path, name):
+    parts = [part for part in os.path.normpath(os.path.splitdrive(name)[1]).split(os.sep) if part not in ['', '.', '..']]
+    return os.path.join(output_path, os.path.splitext(os.path.join(*parts))[0] + '.csv')
+
+
+'''
+Worker process initialization
+'''
+def init_worker(param):
+    global _worker_recognition, _worker_param
+    _worker_recognition = speechEmotionRecognition()
+    _worker_param = param
+
+
+'''
+Worker function computing the time distributed log-mel spectrograms of one file
+'''
+def extract_windows(task):
+
+    # File name (as listed) and path
+    name, filename = task
+
+    try:
+        X = _worker_recognition.extract_features_from_file(filename, chunk_step=_worker_param.get("chunk_step"),
+                                                           chunk_size=_worker_param.get("chunk_size"),
+                                                           sample_rate=_worker_param.get("sample_rate"))
+        return name, X, None
+    except Exception as e:
+        return name, None, "{}: {}".format(type(e).__name__, e)
+
+
+'''
+Function to write the scores of one file (written to a temporary file then moved, so that a CSV is always complete)
+'''
+def write_scores(filename, timestamp, predict, probabilities, emotions):
+
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(filename), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write(",".join(["TIMESTAMP", "EMOTION"] + [emotion.upper() for emotion in emotions]) + '\n')
+        for t, emotion, p in zip(timestamp, predict, probabilities):
+            f.write("{:g},{},{}\n".format(t, emotion, ",".join("{:.6f}".format(value) for value in p)))
+    os.replace(tmp_path, filename)
+
+
+'''
+Function to score all audio files of a directory or manifest
+Returns the number of files scored and the failures (file name, error)
+'''
+def score_files(model, source, output_path, workers=None, queue_size=8, chunk_step=16000, chunk_size=49100,
+                sample_rate=16000, batch_size=32, progress_every=10, output_format='csv', shard_size=100000):
+
+    # Emotion of each probabilities column
+    recognition = speechEmotionRecognition()
+    emotions = [recognition._emotion.get(i) for i in range(len(recognition._emotion))]
+
+    # Files left (those without output)
+    root, files = list_files(source)
+    if output_format == 'timeline':
+        done = timeline_sources(os.path.join(output_path, 'timeline'))
+        tasks = [(name, os.path.join(root, name)) for name in files if name not in done]
+    else:
+        tasks = [(name, os.path.join(root, name)) for name in files
+                 if not os.path.exists(output_filename(output_path, name))]
+    print("Scoring: START ({} files, {} already done)".format(len(files), len(files) - len(tasks)))
+    os.makedirs(output_path, exist_ok=True)
+
+    # Files decoded ahead of the model (bounded queue between the pool and the model)
+    slots = threading.Semaphore(queue_size)
+    stop = threading.Event()
+
+    def bounded_tasks():
+        for task in tasks:
+            while not slots.acquire(timeout=0.1):
+                if stop.is_set():
+                    return
+            yield task
+
+    param = {"chunk_step": chunk_step, "chunk_size": chunk_size, "sample_rate": sample_rate}
+    failures = []
+    nb_files = 0
+    nb_chunks = 0
+    start_time = time.time()
+
+    # Columnar output
+    writer = None
+    if output_format == 'timeline':
+        writer = TimelineWriter(os.path.join(output_path, 'timeline'), classes=emotions, shard_size=shard_size)
+
+    # Pool of processes first (forked before the model exists), then the model
+    pool = multiprocessing.Pool(workers, initializer=init_worker, initargs=(param,))
+    try:
+        session = speechEmotionSession(model, batch_size=batch_size)
+
+        for nb_done, (name, X, error) in enumerate(pool.imap_unordered(extract_windows, bounded_tasks()), 1):
+
+            # Score and write the file as soon as it is ready
+            try:
+                if error is None:
+                    probabilities = session.predict_model(X)
+                    predict, timestamp = session.predictions_to_emotions(probabilities, chunk_step, chunk_size,
+                                                                         sample_rate=sample_rate)
+                    if writer is not None:
+                        writer.append(name, predict, timestamp, probabilities)
+                    else:
+                        write_scores(output_filename(output_path, name), timestamp, predict, probabilities, emotions)
+                    nb_files += 1
+                    nb_chunks += len(probabilities)
+            except Exception as e:
+                error = "{}: {}".format(type(e).__name__, e)
+            finally:
+                X = None
+                slots.release()
+
+            if error is not None:
+                failures.append((name, error))
+                print("Error: {} ({})".format(name, error))
+
+            # Progress and throughput
+            if nb_done % progress_every == 0 or nb_done == len(tasks):
+                duration = time.time() - start_time
+                print("Scoring: RUNNING ... {}/{} files, {} failed ({:.2f} files/s, {:.1f} chunks/s)".format(
+                    nb_done, len(tasks), len(failures), nb_done / duration, nb_chunks / duration))
+    finally:
+        stop.set()
+        pool.terminate()
+        pool.join()
+        if writer is not None:
+            writer.close()
+
+    # Failures of this run (retried by the next one)
+    with open(os.path.join(output_path, 'failures.txt'), 'w') as f:
+        for name, error in failures:
+            f.write("{}\t{}\n".format(name, error))
+
+    # Report
+    duration = time.time() - start_time
+    print("Scoring: END! {} files scored, {} failed in {:.1f} s ({:.2f} files/s, {:.1f} chunks/s)".format(
+        nb_files, len(failures), duration, nb_files / duration if duration > 0 else 0.0,
+        nb_chunks / duration if duration > 0 else 0.0))
+
+    return nb_files, failures
+
+
+'''
+Command line
+'''
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Score the speech emotions of many audio files.")
+    parser.add_argument('model', help="model weights")
+    parser.add_argument('source', help="audio directory, or manifest (one audio file per line)")
+    parser.add_argument('output', help="output directory (one CSV per audio file, or timeline)")
+    parser.add_argument('--workers', type=int, default=None, help="number of decoding processes (default: all CPUs)")
+    parser.add_argument('--queue-size', type=int, default=8, help="files decoded ahead of the model")
+    parser.add_argument('--batch-size', type=int, default=32, help="chunks per model call")
+    parser.add_argument('--chunk-step', type=int, default=16000)
+    parser.add_argument('--chunk-size', type=int, default=49100)
+    parser.add_argument('--sample-rate', type=int, default=16000)
+    parser.add_argument('--progress-every', type=int, default=10, help="files between two progress reports")
+    parser.add_argument('--output-format', default='csv', choices=['csv', 'timeline'],
+                        help="one CSV per file, or columnar timeline shards")
+    parser.add_argument('--shard-size', type=int, default=100000, help="rows per timeline shard")
+    args = parser.parse_args(argv)
+
+    _, failures = score_files(args.model, args.source, args.output, workers=args.workers, queue_size=args.queue_size,
+                              chunk_step=args.chunk_step, chunk_size=args.chunk_size, sample_rate=args.sample_rate,
+                              batch_size=args.batch_size, progress_every=args.progress_every,
+                              output_format=args.output_format, shard_size=args.shard_size)
+
+    return 1 if len(failures) > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
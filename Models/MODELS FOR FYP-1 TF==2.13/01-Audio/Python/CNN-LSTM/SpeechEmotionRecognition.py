@@ -1,7 +1,13 @@
 ## Basics ##
-import time
 import os
+import sys
+import time
+import argparse
+import threading
+import tracemalloc
 import numpy as np
+from functools import lru_cache
+from numpy.lib.stride_tricks import sliding_window_view
 
 ## Audio Preprocessing ##
 import pyaudio
@@ -17,6 +23,49 @@ from tensorflow.keras.layers import Input, Dense, Dropout, Activation, TimeDistr
 from tensorflow.keras.layers import Conv2D, MaxPooling2D, BatchNormalization, Flatten
 from tensorflow.keras.layers import LSTM
 
+## Export ##
+# Timeline writer shared with the SVM scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SVM'))
+from TimelineWriter import TimelineWriter
+
+
+'''
+Ring buffer of the last rows (audio samples or spectrogram frames) of a stream, indexed by absolute position
+'''
+class audioRingBuffer:
+
+    def __init__(self, capacity, row_shape=(), dtype=np.float32):
+
+        # Buffer
+        self._buffer = np.zeros((capacity,) + tuple(row_shape), dtype=dtype)
+
+        # Number of rows written since the start of the stream
+        self._end = 0
+
+    '''
+    Number of rows written since the start of the stream
+    '''
+    @property
+    def end(self):
+        return self._end
+
+    '''
+    Append rows (only the last capacity rows are kept)
+    '''
+    def write(self, rows):
+        rows = rows[-len(self._buffer):]
+        index = np.arange(self._end, self._end + len(rows)) % len(self._buffer)
+        self._buffer[index] = rows
+        self._end += len(rows)
+
+    '''
+    Copy of the rows from absolute position start to stop
+    '''
+    def read(self, start, stop):
+        if start < self._end - len(self._buffer) or stop > self._end:
+            raise IndexError("Error: rows {} to {} are not in the ring buffer.".format(start, stop))
+        return self._buffer[np.arange(start, stop) % len(self._buffer)]
+
 
 '''
 Speech Emotion Recognition
@@ -92,31 +141,101 @@ class speechEmotionRecognition:
     def mel_spectrogram(self, y, sr=16000, n_fft=512, win_length=256, hop_length=128, window='hamming', n_mels=128, fmax=4000):
 
         # Compute spectogram
-        mel_spect = np.abs(librosa.stft(y, n_fft=n_fft, window=window, win_length=win_length, hop_length=hop_length)) ** 2
+        stft = librosa.stft(y, n_fft=n_fft, window=window, win_length=win_length, hop_length=hop_length)
+
+        # Compute log-mel spectrogram
+        return self.stft_to_mel_spectrogram(stft, sr=sr, n_mels=n_mels, fmax=fmax)
 
-        # Compute mel spectrogram
-        mel_spect = librosa.feature.melspectrogram(S=mel_spect, sr=sr, n_mels=n_mels, fmax=fmax)
+
+    '''
+    Log-mel spectrogram of a Short Time Fourier Transform
+    '''
+    def stft_to_mel_spectrogram(self, stft, sr=16000, n_mels=128, fmax=4000):
+
+        # Compute power spectogram
+        mel_spect = np.abs(stft) ** 2
 
         # Compute log-mel spectrogram
-        mel_spect = librosa.power_to_db(mel_spect, ref=np.max)
+        return self.power_to_mel_db(mel_spect, sr=sr, n_mels=n_mels, fmax=fmax)
+
+
+    '''
+    Mel filter bank (cached, read-only)
+    '''
+    @staticmethod
+    @lru_cache(maxsize=16)
+    def mel_basis(sr=16000, n_fft=512, n_mels=128, fmax=4000):
+        mel_basis = librosa.filters.mel(sr=sr, n_fft=n_fft, n_mels=n_mels, fmax=fmax)
+        mel_basis.flags.writeable = False
+        return mel_basis
+
+
+    '''
+    Log-mel spectrograms of power spectrograms (..., frequency, time), each in dB relative to its own maximum
+    (librosa melspectrogram then power_to_db with ref=np.max, amin=1e-10 and top_db=80), written into out if given
+    '''
+    def power_to_mel_db(self, power, sr=16000, n_mels=128, fmax=4000, out=None, amin=1e-10, top_db=80.0):
+
+        # Compute mel spectrogram (single matmul with the cached mel basis)
+        mel_spect = np.matmul(self.mel_basis(sr, 2 * (power.shape[-2] - 1), n_mels, fmax), power)
+
+        # Reference power: maximum of each spectrogram
+        ref = np.max(mel_spect, axis=(-2, -1), keepdims=True)
+
+        # Compute log-mel spectrogram (dB relative to the reference, at most top_db below the maximum)
+        np.maximum(mel_spect, amin, out=mel_spect)
+        np.log10(mel_spect, out=mel_spect)
+        mel_spect *= 10.0
+        mel_spect -= 10.0 * np.log10(np.maximum(amin, ref))
+        return np.maximum(mel_spect, np.max(mel_spect, axis=(-2, -1), keepdims=True) - top_db, out=out)
+
+
+    '''
+    Log-mel spectrograms of a batch of chunks (one row per chunk), written into a preallocated (chunks, n_mels, frames)
+    tensor of type dtype: all chunks of a batch are z-normalized in one pass, go through a single stacked STFT and a
+    single matmul with the cached mel basis (batch_size bounds the memory of the intermediate spectrograms)
+    '''
+    def mel_spectrogram_batch(self, y, sr=16000, n_fft=512, win_length=256, hop_length=128, window='hamming', n_mels=128,
+                              fmax=4000, dtype=np.float16, batch_size=64):
+
+        # Preallocated log-mel spectrograms
+        mel_spect = np.empty((y.shape[0], n_mels, 1 + y.shape[1] // hop_length), dtype=dtype)
+
+        for start in range(0, y.shape[0], batch_size):
+
+            # Z-normalization of all chunks of the batch (in the type of y, float16 chunks as in training)
+            chunks = zscore(np.asarray(y[start:start + batch_size]), axis=1)
+
+            # Compute power spectograms of all chunks of the batch
+            power = np.abs(librosa.stft(chunks, n_fft=n_fft, window=window, win_length=win_length,
+                                        hop_length=hop_length)) ** 2
+
+            # Compute log-mel spectrograms into the output tensor
+            self.power_to_mel_db(power, sr=sr, n_mels=n_mels, fmax=fmax, out=mel_spect[start:start + batch_size])
 
-        return np.asarray(mel_spect)
+        return mel_spect
 
 
     '''
     Audio framing
+    Windows are read through a strided view of y (no copy per window) and cast to dtype in a single pass into a
+    contiguous (a, frames, b, win_size) tensor; dtype=None returns the read-only view itself
     '''
-    def frame(self, y, win_step=64, win_size=128):
+    def frame(self, y, win_step=64, win_size=128, dtype=np.float16):
 
         # Number of frames
-        nb_frames = 1 + int((y.shape[2] - win_size) / win_step)
+        nb_frames = 1 + (y.shape[2] - win_size) // win_step if y.shape[2] >= win_size else 0
 
-        # Framming
-        frames = np.zeros((y.shape[0], nb_frames, y.shape[1], win_size)).astype(np.float16)
-        for t in range(nb_frames):
-            frames[:,t,:,:] = np.copy(y[:,:,(t * win_step):(t * win_step + win_size)]).astype(np.float16)
+        # Framming (strided view, one row per window)
+        if nb_frames > 0:
+            frames = sliding_window_view(y, win_size, axis=2)[:, :, ::win_step].transpose(0, 2, 1, 3)
+        else:
+            frames = np.zeros((y.shape[0], 0, y.shape[1], win_size), dtype=y.dtype)
 
-        return frames
+        # Cast once
+        if dtype is None:
+            return frames
+        return frames.astype(dtype, order='C')
 
 
     '''
@@ -173,25 +292,127 @@ class speechEmotionRecognition:
         return model
 
 
+    '''
+    Emotion probabilities of a batch of time distributed log-mel spectrograms
+    '''
+    def predict_model(self, X):
+        return self._model.predict(X, verbose=0)
+
+
+    '''
+    Model split into a per-window CNN encoder (the layers wrapped by the time distributed layers up to Flat_MELSPECT,
+    applied to single (128, 128, 1) windows) and an LSTM head (LSTM_1 and FC, applied to sequences of window
+    embeddings). Both share the weights of the model and are built on first use
+    '''
+    def split_model(self):
+
+        if getattr(self, '_encoder', None) is None:
+
+            # Per-window CNN encoder
+            input_window = Input(shape=tuple(self._model.input_shape[2:]), name='Input_WINDOW')
+            y = input_window
+            for layer in self._model.layers:
+                if isinstance(layer, TimeDistributed):
+                    y = layer.layer(y)
+                    if layer.name == 'Flat_MELSPECT':
+                        break
+            self._encoder = Model(inputs=input_window, outputs=y)
+
+            # LSTM head
+            input_embedding = Input(shape=(self._model.input_shape[1], self._encoder.output_shape[-1]),
+                                    name='Input_EMBEDDING')
+            y = self._model.get_layer('LSTM_1')(input_embedding)
+            y = self._model.get_layer('FC')(y)
+            self._head = Model(inputs=input_embedding, outputs=y)
+
+        return self._encoder, self._head
+
+
+    '''
+    Embeddings of a batch of single log-mel windows (windows, 128, 128, 1)
+    '''
+    def predict_encoder(self, W):
+        return self.split_model()[0].predict(W, verbose=0)
+
+
+    '''
+    Emotion probabilities of a batch of window embeddings sequences (chunks, 5, features)
+    '''
+    def predict_head(self, E):
+        return self.split_model()[1].predict(E, verbose=0)
+
+
+    '''
+    Emotion probabilities of the chunks of a signal, reusing window embeddings across chunks
+    The log-mel spectrogram is computed once for the whole signal (z-normalization and dB reference over the file
+    instead of each chunk), and the windows of every chunk are snapped to a grid of win_step frames over the file, so
+    that overlapping chunks share windows: each grid window goes through the CNN encoder once, and only the LSTM head
+    runs per chunk. Predictions approximate those of predict_model (same model, file-level normalization and windows
+    shifted by at most win_step / 2 frames): measure_reuse_agreement reports how far they move on a set of files
+    '''
+    def predict_model_reuse(self, y, chunk_step=16000, chunk_size=49100, hop_length=128, win_step=64, win_size=128):
+
+        # Number of chunks and of windows per chunk
+        nb_chunks = 1 + (len(y) - chunk_size) // chunk_step if len(y) >= chunk_size else 0
+        nb_steps = 1 + (1 + chunk_size // hop_length - win_size) // win_step
+        if nb_chunks == 0:
+            return np.zeros((0, len(self._emotion)), dtype=np.float32)
+
+        # Log-mel spectrogram of the whole signal
+        mel_spect = self.mel_spectrogram_batch(y.reshape(1, -1), hop_length=hop_length, dtype=np.float32)
+
+        # Windows of the file grid (strided view)
+        windows = self.frame(mel_spect, win_step, win_size, dtype=None)[0]
+
+        # First grid window of each chunk (nearest to the chunk start) and grid windows of each chunk
+        first = np.round(np.arange(nb_chunks) * chunk_step / (hop_length * win_step)).astype(int)
+        first = np.minimum(first, len(windows) - nb_steps)
+        positions = first[:, np.newaxis] + np.arange(nb_steps)
+
+        # Embed each window used by at least one chunk once
+        used = np.unique(positions)
+        embeddings = np.zeros((len(windows), self.split_model()[0].output_shape[-1]), dtype=np.float32)
+        embeddings[used] = self.predict_encoder(windows[used].astype(np.float16)[..., np.newaxis])
+
+        # LSTM head on the embeddings sequence of each chunk
+        return self.predict_head(embeddings[positions])
+
+
     '''
     Predict speech emotion over time from an audio file
     '''
-    def predict_emotion_from_file(self, filename, chunk_step=16000, chunk_size=49100, predict_proba=False, sample_rate=16000):
+    def predict_emotion_from_file(self, filename, chunk_step=16000, chunk_size=49100, predict_proba=False, sample_rate=16000,
+                                  reuse_windows=False):
+
+        # Window embeddings shared by overlapping chunks
+        if reuse_windows is True:
+            y, sr = librosa.core.load(filename, sr=sample_rate, offset=0.5)
+            return self.predictions_to_emotions(self.predict_model_reuse(y, chunk_step, chunk_size), chunk_step,
+                                                chunk_size, predict_proba, sample_rate)
+
+        # Time distributed log-mel spectrograms of all chunks
+        X = self.extract_features_from_file(filename, chunk_step, chunk_size, sample_rate)
+
+        # Predict emotion
+        return self.predictions_to_emotions(self.predict_model(X), chunk_step, chunk_size, predict_proba, sample_rate)
+
+
+    '''
+    Time distributed log-mel spectrograms (chunks, 5, 128, 128, 1) of the chunks of an audio file
+    '''
+    def extract_features_from_file(self, filename, chunk_step=16000, chunk_size=49100, sample_rate=16000):
 
         # Read audio file
         y, sr = librosa.core.load(filename, sr=sample_rate, offset=0.5)
 
-        # Split audio signals into chunks
+        # Split audio signals into chunks (cast to float16 before the z-normalization, as in training)
         chunks = self.frame(y.reshape(1, 1, -1), chunk_step, chunk_size)
 
         # Reshape chunks
         chunks = chunks.reshape(chunks.shape[1],chunks.shape[-1])
 
-        # Z-normalization
-        y = np.asarray(list(map(zscore, chunks)))
-
-        # Compute mel spectrogram
-        mel_spect = np.asarray(list(map(self.mel_spectrogram, y)))
+        # Z-normalization and mel spectrogram of all chunks
+        mel_spect = self.mel_spectrogram_batch(chunks)
 
         # Time distributed Framing
         mel_spect_ts = self.frame(mel_spect)
@@ -203,22 +424,215 @@ class speechEmotionRecognition:
                                     mel_spect_ts.shape[3],
                                     1)
 
+        return X
+
+
+    '''
+    Emotions (or probabilities) and timestamps of the chunks of a file from the model probabilities
+    '''
+    def predictions_to_emotions(self, probabilities, chunk_step=16000, chunk_size=49100, predict_proba=False,
+                                sample_rate=16000):
+
         # Predict emotion
         if predict_proba is True:
-            predict = self._model.predict(X)
+            predict = probabilities
         else:
-            predict = np.argmax(self._model.predict(X), axis=1)
+            predict = np.argmax(probabilities, axis=1)
             predict = [self._emotion.get(emotion) for emotion in predict]
 
-        # Clear Keras session
-        K.clear_session()
-
         # Predict timestamp
-        timestamp = np.concatenate([[chunk_size], np.ones((len(predict) - 1)) * chunk_step]).cumsum()
+        timestamp = chunk_size + np.arange(len(predict)) * float(chunk_step)
         timestamp = np.round(timestamp / sample_rate)
 
         return [predict, timestamp]
 
+    '''
+    Audio blocks recorded from the microphone until the generator is closed (16 bits samples, or mono floats in [-1, 1]
+    down-mixed from several channels)
+    '''
+    def microphone_stream(self, sample_rate=16000, chunk=1024, channels=1):
+
+        # Start the audio recording stream
+        p = pyaudio.PyAudio()
+        stream = p.open(format=pyaudio.paInt16,
+                        channels=channels,
+                        rate=sample_rate,
+                        input=True,
+                        frames_per_buffer=chunk)
+
+        try:
+            while True:
+
+                # Record data audio data (mono)
+                data = np.frombuffer(stream.read(chunk, exception_on_overflow=False), dtype=np.int16)
+                yield (data.reshape(-1, channels).mean(axis=1) / 32768.0).astype(np.float32) if channels > 1 else data
+
+        finally:
+
+            # Close the audio recording stream
+            stream.stop_stream()
+            stream.close()
+            p.terminate()
+
+
+    '''
+    Audio blocks read from a WAV file (8, 16 or 32 bits integer samples, down-mixed to mono floats in [-1, 1]), or
+    from a raw mono 16 bits PCM file or pipe (file object, 16 bits samples)
+    Samples must be at sample_rate: a WAV file at another frame rate raises a ValueError
+    '''
+    def pcm_stream(self, source, block_size=1024, sample_rate=16000):
+
+        # WAV file
+        if isinstance(source, str) and source.endswith('.wav'):
+            with wave.open(source, 'rb') as wf:
+                channels, sampwidth = wf.getnchannels(), wf.getsampwidth()
+                if wf.getframerate() != sample_rate:
+                    raise ValueError("Error: {} is sampled at {} Hz, not {} Hz.".format(source, wf.getframerate(),
+                                                                                        sample_rate))
+
+                # Sample type, offset and full scale of each sample width (8 bits WAV samples are unsigned)
+                if sampwidth not in [1, 2, 4]:
+                    raise ValueError("Error: {} has {} bits samples (8, 16 or 32 bits expected).".format(source,
+                                                                                                      8 * sampwidth))
+                dtype = {1: np.uint8, 2: np.int16, 4: np.int32}[sampwidth]
+                offset = 128.0 if sampwidth == 1 else 0.0
+                scale = float(2 ** (8 * sampwidth - 1))
+
+                while True:
+                    data = wf.readframes(block_size)
+                    if len(data) == 0:
+                        break
+                    block = np.frombuffer(data, dtype=dtype).reshape(-1, channels).mean(axis=1, dtype=np.float64)
+                    yield ((block - offset) / scale).astype(np.float32)
+            return
+
+        # Raw PCM file or pipe
+        f = open(source, 'rb') if isinstance(source, str) else source
+        try:
+            while True:
+                data = f.read(2 * block_size)
+                if len(data) < 2:
+                    break
+                yield np.frombuffer(data[:len(data) // 2 * 2], dtype=np.int16)
+        finally:
+            if isinstance(source, str):
+                f.close()
+
+
+    '''
+    Predict speech emotion over time from a live audio stream
+    source is None (microphone), a WAV / raw PCM file name or file object (see pcm_stream), or any iterable of
+    sample blocks (16 bits integers or floats in [-1, 1]) at sample_rate
+    Yields (timestamp, prediction) every chunk_step samples, as soon as the chunk ending at timestamp is complete
+    (timestamp in seconds, rounded as the timestamps of predict_emotion_from_file).
+    The STFT of the stream is computed once, one frame per new hop, into a ring buffer; each chunk only normalizes
+    these frames (the STFT is linear) and recomputes its few zero-padded edge frames.
+    '''
+    def predict_emotion_from_stream(self, source=None, chunk_step=16000, chunk_size=49100, predict_proba=False,
+                                    sample_rate=16000, n_fft=512, win_length=256, hop_length=128, window='hamming'):
+
+        # Audio blocks
+        if source is None:
+            blocks = self.microphone_stream(sample_rate)
+        elif isinstance(source, str) or hasattr(source, 'read'):
+            blocks = self.pcm_stream(source, sample_rate=sample_rate)
+        else:
+            blocks = iter(source)
+
+        # STFT parameters
+        stft_param = dict(n_fft=n_fft, window=window, win_length=win_length, hop_length=hop_length)
+        pad = n_fft // 2
+        incremental = chunk_step % hop_length == 0 and pad % hop_length == 0
+
+        # Chunk STFT frames: zero-padded head frames, frames shared with the stream, zero-padded tail frames
+        nb_frames = 1 + chunk_size // hop_length
+        first_shared = pad // hop_length
+        first_tail = (chunk_size - pad) // hop_length + 1
+        tail_start = max(first_tail - -(-n_fft // hop_length), 0) * hop_length
+
+        # STFT of the window (mean of a chunk contribution to its frames)
+        window_stft = librosa.stft(np.ones(n_fft, dtype=np.float32), center=False, **stft_param)[:, 0]
+
+        # Ring buffers of the last samples and of the last STFT frames of the stream
+        samples = audioRingBuffer(chunk_size + chunk_step + n_fft)
+        frames = audioRingBuffer((chunk_size + chunk_step) // hop_length + 2, (1 + n_fft // 2,), np.complex64)
+
+        chunk_start = 0
+        try:
+            for block in blocks:
+
+                # Samples as float in [-1, 1]
+                block = np.asarray(block)
+                if block.dtype.kind in 'iu':
+                    block = block / 32768.0
+                block = block.astype(np.float32)
+
+                # Pieces of at most chunk_step samples, so that no sample is dropped before its chunk is complete
+                for start in range(0, len(block), chunk_step):
+                    samples.write(block[start:start + chunk_step])
+
+                    # STFT frames of the new hops
+                    if incremental:
+                        nb_new = (samples.end - n_fft) // hop_length + 1 - frames.end
+                        if nb_new > 0:
+                            y = samples.read(frames.end * hop_length, (frames.end + nb_new - 1) * hop_length + n_fft)
+                            frames.write(librosa.stft(y, center=False, **stft_param).T)
+
+                    # Predict complete chunks
+                    while samples.end >= chunk_start + chunk_size:
+                        y = samples.read(chunk_start, chunk_start + chunk_size)
+
+                        # Z-normalization
+                        mean, std = np.mean(y), np.std(y)
+                        y = zscore(y)
+
+                        # STFT of the normalized chunk
+                        if incremental:
+                            stft = np.empty((1 + n_fft // 2, nb_frames), dtype=np.complex64)
+                            stft[:, :first_shared] = librosa.stft(y[:first_shared * hop_length + n_fft],
+                                                                  **stft_param)[:, :first_shared]
+                            shared = frames.read(chunk_start // hop_length,
+                                                 chunk_start // hop_length + first_tail - first_shared).T
+                            stft[:, first_shared:first_tail] = (shared - mean * window_stft[:, np.newaxis]) / std
+                            stft[:, first_tail:] = librosa.stft(y[tail_start:],
+                                                                **stft_param)[:, first_tail - tail_start // hop_length:]
+                        else:
+                            stft = librosa.stft(y, **stft_param)
+
+                        # Time distributed log-mel spectrogram frames
+                        mel_spect = self.stft_to_mel_spectrogram(stft, sr=sample_rate)
+                        mel_spect_ts = self.frame(mel_spect[np.newaxis])
+                        X = mel_spect_ts.reshape(mel_spect_ts.shape + (1,))
+
+                        # Predict emotion
+                        predict = self.predict_model(X)[0]
+                        if predict_proba is False:
+                            predict = self._emotion.get(int(np.argmax(predict)))
+
+                        # Timestamp rounded to the second, as in predictions_to_emotions
+                        yield np.round((chunk_start + chunk_size) / sample_rate), predict
+                        chunk_start += chunk_step
+
+        # Close the audio source (e.g. stop the microphone) when the stream ends or is closed
+        finally:
+            if blocks is not source and hasattr(blocks, 'close'):
+                blocks.close()
+
+
+    '''
+    Call callback(timestamp, prediction) for each prediction of a live audio stream (see predict_emotion_from_stream),
+    until the stream ends or the callback returns False
+    '''
+    def listen(self, callback, source=None, **kwargs):
+        stream = self.predict_emotion_from_stream(source, **kwargs)
+        try:
+            for timestamp, predict in stream:
+                if callback(timestamp, predict) is False:
+                    break
+        finally:
+            stream.close()
+
+
     '''
     Export emotions predicted to csv format
     '''
@@ -231,3 +645,220 @@ class speechEmotionRecognition:
             for emotion in predictions:
                 f.write(str(emotion)+'\n')
             f.close()
+
+
+    '''
+    Timeline writer for the predictions of this model (one probabilities column per emotion unless
+    probabilities=False)
+    '''
+    def timeline_writer(self, timeline_path, probabilities=True, shard_size=100000, compress=False):
+        classes = [self._emotion.get(i) for i in range(len(self._emotion))] if probabilities is True else None
+        return TimelineWriter(timeline_path, classes=classes, shard_size=shard_size, compress=compress)
+
+
+    '''
+    Export predictions of a file ([predict, timestamp] of predict_emotion_from_file, emotions or probabilities) to a
+    timeline writer
+    '''
+    def prediction_to_timeline(self, predictions, writer, source):
+
+        predict, timestamp = predictions
+
+        # Probabilities: emotion of highest probability
+        if np.ndim(predict) == 2:
+            probabilities = np.asarray(predict)
+            predict = [self._emotion.get(emotion) for emotion in np.argmax(probabilities, axis=1)]
+        else:
+            probabilities = None
+            if writer.classes is not None:
+                raise ValueError("Error: the timeline has probabilities columns, predict with predict_proba=True.")
+
+        writer.append(source, predict, timestamp, probabilities if writer.classes is not None else None)
+
+
+'''
+Speech Emotion Recognition inference session
+The model is built and loaded once, and inference runs through a traced function with a fixed input signature
+(no retracing between files), warmed up at construction. Calls are serialized by a lock, so that one session can be
+shared by several threads (audio decoding and spectrograms of the calling threads still run concurrently).
+'''
+class speechEmotionSession(speechEmotionRecognition):
+
+    def __init__(self, subdir_model, batch_size=32, warmup=True):
+
+        # Build and load model
+        super().__init__(subdir_model)
+
+        # Windows batch size of a model call
+        self._batch_size = batch_size
+
+        # Traced inference function (any number of chunks)
+        self._predict_function = tf.function(lambda X: self._model(X, training=False),
+                                             input_signature=[tf.TensorSpec(shape=(None,) + tuple(
+                                                 self._model.input_shape[1:]), dtype=tf.float32)])
+
+        # Per-window encoder and LSTM head (built before any call, so that concurrent calls share them)
+        self._encoder, self._head = self.split_model()
+
+        # Lock of the model calls
+        self._lock = threading.Lock()
+
+        # Warmup pass (tracing and kernels initialization)
+        if warmup is True:
+            self.predict_model(np.zeros((batch_size,) + tuple(self._model.input_shape[1:]), dtype=np.float16))
+
+    '''
+    Emotion probabilities of a batch of time distributed log-mel spectrograms
+    '''
+    def predict_model(self, X):
+        predict = []
+        with self._lock:
+            for start in range(0, len(X), self._batch_size):
+                batch = tf.convert_to_tensor(np.asarray(X[start:start + self._batch_size], dtype=np.float32))
+                predict.append(self._predict_function(batch).numpy())
+        return np.concatenate(predict) if len(predict) > 0 else np.zeros((0, len(self._emotion)), dtype=np.float32)
+
+    '''
+    Embeddings of a batch of single log-mel windows
+    '''
+    def predict_encoder(self, W):
+        with self._lock:
+            return np.concatenate([self._encoder(np.asarray(W[start:start + self._batch_size], dtype=np.float32),
+                                                 training=False).numpy()
+                                   for start in range(0, len(W), self._batch_size)])
+
+    '''
+    Emotion probabilities of a batch of window embeddings sequences
+    '''
+    def predict_head(self, E):
+        with self._lock:
+            return np.concatenate([self._head(E[start:start + self._batch_size], training=False).numpy()
+                                   for start in range(0, len(E), self._batch_size)])
+
+
+'''
+Per-file prediction latency (best over repeat runs) of a recognition object
+'''
+def measure_latency(recognition, filenames, repeat=3, **kwargs):
+    latency = {}
+    for filename in filenames:
+        latency[filename] = float('inf')
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            recognition.predict_emotion_from_file(filename, **kwargs)
+            latency[filename] = min(latency[filename], time.perf_counter() - start_time)
+    return latency
+
+
+'''
+Agreement of the window embeddings reuse (predict_model_reuse) with the per-chunk predictions (predict_model) on
+each file: number of chunks, fraction of chunks with the same emotion, mean and largest absolute probability difference
+'''
+def measure_reuse_agreement(recognition, filenames, chunk_step=16000, chunk_size=49100, sample_rate=16000):
+    agreement = {}
+    for filename in filenames:
+        y, sr = librosa.core.load(filename, sr=sample_rate, offset=0.5)
+        X = recognition.extract_features_from_file(filename, chunk_step, chunk_size, sample_rate)
+        probabilities = recognition.predict_model(X)
+        reuse = recognition.predict_model_reuse(y, chunk_step, chunk_size)
+        if len(probabilities) == 0:
+            agreement[filename] = (0, float('nan'), float('nan'), float('nan'))
+            continue
+        difference = np.abs(reuse - probabilities)
+        agreement[filename] = (len(probabilities), float(np.mean(reuse.argmax(axis=1) == probabilities.argmax(axis=1))),
+                               float(difference.mean()), float(difference.max()))
+    return agreement
+
+
+'''
+Time (best over repeat runs) and peak memory of the framing steps of predict_emotion_from_file on long synthetic
+signals: raw audio into chunks, then log-mel spectrograms of the chunks into time distributed windows
+'''
+def benchmark_frame(durations=[60, 600], sample_rate=16000, chunk_step=16000, chunk_size=49100, repeat=3):
+
+    recognition = speechEmotionRecognition()
+    random_state = np.random.RandomState(0)
+
+    results = []
+    for duration in durations:
+
+        # Synthetic signal and log-mel spectrograms of its chunks
+        y = random_state.randn(int(duration * sample_rate)).astype(np.float32)
+        nb_chunks = 1 + (len(y) - chunk_size) // chunk_step
+        mel_spect = random_state.randn(nb_chunks, 128, 1 + chunk_size // 128).astype(np.float16)
+
+        steps = [("chunks", lambda: recognition.frame(y.reshape(1, 1, -1), chunk_step, chunk_size, dtype=None)),
+                 ("mel_windows", lambda: recognition.frame(mel_spect))]
+        for name, function in steps:
+
+            # Peak memory
+            tracemalloc.start()
+            function()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            # Best time
+            best_time = float('inf')
+            for _ in range(repeat):
+                start_time = time.perf_counter()
+                function()
+                best_time = min(best_time, time.perf_counter() - start_time)
+
+            results.append((duration, name, best_time, peak_memory))
+
+    return results
+
+
+'''
+Command line: per-file latency of a model rebuilt for each file, of a plain model, of a warm session and of a warm
+session reusing window embeddings across chunks (with its agreement with the per-chunk predictions)
+    python SpeechEmotionRecognition.py MODEL_CNN_LSTM.hdf5 audio_1.wav audio_2.wav
+Framing benchmark on long synthetic signals (no model needed)
+    python SpeechEmotionRecognition.py --benchmark-frame 60 600 3600
+'''
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Per-file latency of the speech emotion recognition model.")
+    parser.add_argument('model', nargs='?', default=None, help="model weights")
+    parser.add_argument('files', nargs='*', help="audio files")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per file (best time is kept)")
+    parser.add_argument('--benchmark-frame', type=float, nargs='+', default=None, metavar='DURATION',
+                        help="benchmark framing on synthetic signals of these durations (s)")
+    args = parser.parse_args(argv)
+
+    # Framing benchmark
+    if args.benchmark_frame is not None:
+        print("DURATION (s),STEP,TIME (s),PEAK MEMORY (MB)")
+        for duration, name, best_time, peak_memory in benchmark_frame(args.benchmark_frame, repeat=args.repeat):
+            print("{:g},{},{:.4f},{:.1f}".format(duration, name, best_time, peak_memory / 2 ** 20))
+        return 0
+
+    if args.model is None or len(args.files) == 0:
+        parser.error("the model weights and at least one audio file are required")
+
+    # Model built and loaded for each file
+    cold = {}
+    for filename in args.files:
+        start_time = time.perf_counter()
+        speechEmotionRecognition(args.model).predict_emotion_from_file(filename)
+        cold[filename] = time.perf_counter() - start_time
+
+    # Plain model (Keras predict), then warm session
+    plain = measure_latency(speechEmotionRecognition(args.model), args.files, args.repeat)
+    session = speechEmotionSession(args.model)
+    warm = measure_latency(session, args.files, args.repeat)
+
+    # Warm session with window embeddings shared by overlapping chunks, and its agreement with per-chunk predictions
+    reuse = measure_latency(session, args.files, args.repeat, reuse_windows=True)
+    agreement = measure_reuse_agreement(session, args.files)
+
+    print("FILE,COLD (s),PLAIN (s),SESSION (s),REUSE (s),CHUNKS,REUSE AGREEMENT,REUSE MEAN DIFF,REUSE MAX DIFF")
+    for filename in args.files:
+        print("{},{:.3f},{:.3f},{:.3f},{:.3f},{},{:.3f},{:.4f},{:.4f}".format(
+            filename, cold[filename], plain[filename], warm[filename], reuse[filename], *agreement[filename]))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
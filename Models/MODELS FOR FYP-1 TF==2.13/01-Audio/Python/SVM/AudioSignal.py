@@ -1,36 +1,32 @@
 import os
+import wave
+import subprocess
 import numpy
-from pydub import AudioSegment
+from numpy.lib.stride_tricks import sliding_window_view
 from scipy.fftpack import fft
 
 
 class AudioSignal(object):
 
-    def __init__(self, sample_rate, signal=None, filename=None):
+    def __init__(self, sample_rate, signal=None, filename=None, dtype=numpy.float64):
 
         # Set sample rate
         self._sample_rate = sample_rate
 
+        # Floating point type of computations (numpy.float32 halves memory traffic)
+        self._dtype = numpy.dtype(dtype)
+
         if signal is None:
 
             # Get file name and file extension
             file, file_extension = os.path.splitext(filename)
 
-            # Check if file extension if audio format
-            if file_extension in ['.mp3', '.wav']:
+            # Check if file extension if audio or video format
+            if file_extension in ['.mp3', '.wav', '.mp4', '.mkv', '.avi']:
 
-                # Read audio file
+                # Read audio file (audio is decoded from the video in memory)
                 self._signal = self.read_audio_file(filename)
 
-            # Check if file extension if video format
-            elif file_extension in ['.mp4', '.mkv', 'avi']:
-
-                # Extract audio from video
-                new_filename = self.extract_audio_from_video(filename)
-
-                # read audio file from extracted audio file
-                self._signal = self.read_audio_file(new_filename)
-
             # Case file extension is not supported
             else:
                 print("Error: file not found or file extension not supported.")
@@ -53,7 +49,8 @@ class AudioSignal(object):
         file, file_extension = os.path.splitext(filename)
 
         # Extract audio (.wav) from video
-        os.system('ffmpeg -i ' + file + file_extension + ' ' + '-ar ' + str(self._sample_rate) + ' ' + file + '.wav')
+        subprocess.run(['ffmpeg', '-nostdin', '-loglevel', 'error', '-y', '-i', filename, '-vn',
+                        '-ar', str(self._sample_rate), file + '.wav'], check=True)
         print("Sucessfully converted {} into audio!".format(filename))
 
         # Return audio file name created
@@ -61,37 +58,161 @@ class AudioSignal(object):
 
     '''
     Function to read audio file and to return audio samples of a specified WAV file
+    WAV files at the right sample rate are read directly, other audio (or video) files are decoded and resampled
+    in memory through an ffmpeg pipe, without intermediate file
     '''
     def read_audio_file(self, filename):
 
-        # Get audio signal
-        audio_file = AudioSegment.from_file(filename)
+        # Read WAV file samples at once
+        wav_file = self.open_wav_file(filename, self._sample_rate)
+        if wav_file is not None:
+            with wav_file:
+                dtype = numpy.int16 if wav_file.getsampwidth() == 2 else numpy.int32
+                data = numpy.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype)
+                audio_signal = data.reshape(-1, wav_file.getnchannels())
 
-        # Resample audio signal
-        audio_file = audio_file.set_frame_rate(self._sample_rate)
+            # Convert stereo to mono
+            return self.stereo_to_mono(audio_signal)
 
-        # Cast to integer
-        if audio_file.sample_width == 2:
-            data = numpy.fromstring(audio_file._data, numpy.int16)
-        elif audio_file.sample_width == 4:
-            data = numpy.fromstring(audio_file._data, numpy.int32)
+        # Decode (and resample) any other file
+        return self.decode_audio_file(filename, self._sample_rate)
 
-        # Merge audio channels
-        audio_signal = []
-        for chn in list(range(audio_file.channels)):
-            audio_signal.append(data[chn::audio_file.channels])
-        audio_signal = numpy.array(audio_signal).T
+    '''
+    Function to decode an audio (or video) file into mono 16 bits samples at sample_rate, reading the ffmpeg output
+    pipe straight into a buffer (doubled whenever full) which is then used as the samples array without copy
+    '''
+    @classmethod
+    def decode_audio_file(cls, filename, sample_rate, buffer_size=1 << 20):
+
+        # Start decoding
+        process = subprocess.Popen(cls.ffmpeg_command(filename, sample_rate), stdout=subprocess.PIPE)
+
+        # Read decoded samples into the buffer
+        buffer = bytearray(buffer_size)
+        nb_bytes = 0
+        with process.stdout:
+            while True:
+                if nb_bytes == len(buffer):
+                    buffer.extend(bytes(len(buffer)))
+                view = memoryview(buffer)[nb_bytes:]
+                nb_read = process.stdout.readinto(view)
+                view.release()
+                if not nb_read:
+                    break
+                nb_bytes = nb_bytes + nb_read
+        process.wait()
+
+        # Case file can not be decoded
+        if process.returncode != 0:
+            raise IOError("Error: ffmpeg could not decode {}.".format(filename))
+
+        # Drop the unused end of the buffer
+        del buffer[nb_bytes - nb_bytes % 2:]
+
+        return numpy.frombuffer(buffer, numpy.int16)
 
-        # Flat signals
-        if audio_signal.ndim == 2:
-            if audio_signal.shape[1] == 1:
-                audio_signal = audio_signal.flatten()
+    '''
+    Function to open a WAV file which samples can be read without decoding nor resampling (None otherwise)
+    '''
+    @staticmethod
+    def open_wav_file(filename, sample_rate):
 
-        # Convert stereo to mono
-        audio_signal = self.stereo_to_mono(audio_signal)
+        # Get file name and file extension
+        file, file_extension = os.path.splitext(filename)
+        if file_extension != '.wav':
+            return None
+
+        # Only 16 or 32 bits PCM at the right sample rate
+        try:
+            wav_file = wave.open(filename, 'rb')
+        except (wave.Error, EOFError):
+            return None
+        if wav_file.getframerate() != sample_rate or wav_file.getsampwidth() not in (2, 4):
+            wav_file.close()
+            return None
 
-        # Return sample rate and audio signal
-        return audio_signal
+        return wav_file
+
+    '''
+    Function to build the ffmpeg command decoding a file into mono 16 bits samples at sample_rate on its standard output
+    '''
+    @staticmethod
+    def ffmpeg_command(filename, sample_rate):
+        return ['ffmpeg', '-nostdin', '-loglevel', 'error', '-i', filename, '-vn',
+                '-f', 's16le', '-acodec', 'pcm_s16le', '-ac', '1', '-ar', str(sample_rate), '-']
+
+    '''
+    Function to read an audio (or video) file as a stream of blocks of block_size samples, one every block_step samples
+    Consecutive blocks overlap by block_size - block_step samples (e.g. the overlap needed for framing), and only
+    one block (plus one read buffer) is kept in memory whatever the length of the file. The trailing block shorter
+    than block_size is only returned with partial=True.
+    '''
+    @classmethod
+    def stream_audio_file(cls, filename, sample_rate, block_size, block_step, partial=False, buffer_size=65536):
+
+        # Samples not yet returned in a block
+        pending = None
+
+        # Samples to skip when blocks do not overlap (block_step > block_size)
+        skip = 0
+
+        for data in cls.read_pcm_blocks(filename, sample_rate, buffer_size):
+
+            # Skip samples between blocks
+            if skip > 0:
+                nb_skip = min(skip, len(data))
+                data = data[nb_skip:]
+                skip = skip - nb_skip
+
+            # Append new samples
+            pending = data if pending is None else numpy.concatenate((pending, data))
+
+            # Return all full blocks
+            while len(pending) >= block_size:
+                yield pending[:block_size]
+                skip = max(block_step - len(pending), 0)
+                pending = pending[block_step:]
+
+        # Return the trailing block
+        if partial is True and pending is not None and len(pending) > 0:
+            yield pending
+
+    '''
+    Function to read the mono samples of an audio (or video) file, buffer_size samples at a time
+    WAV files at the right sample rate are read directly, other files are decoded and resampled through an ffmpeg pipe
+    '''
+    @classmethod
+    def read_pcm_blocks(cls, filename, sample_rate, buffer_size=65536):
+
+        # Read WAV file samples directly
+        wav_file = cls.open_wav_file(filename, sample_rate)
+        if wav_file is not None:
+            with wav_file:
+                dtype = numpy.int16 if wav_file.getsampwidth() == 2 else numpy.int32
+                channels = wav_file.getnchannels()
+                while True:
+                    data = wav_file.readframes(buffer_size)
+                    if len(data) == 0:
+                        return
+                    yield cls.stereo_to_mono(numpy.frombuffer(data, dtype).reshape(-1, channels))
+
+        # Decode (and resample) any other file with ffmpeg
+        process = subprocess.Popen(cls.ffmpeg_command(filename, sample_rate), stdout=subprocess.PIPE)
+        try:
+            while True:
+                data = process.stdout.read(2 * buffer_size)
+                if len(data) == 0:
+                    break
+                yield numpy.frombuffer(data[:len(data) - len(data) % 2], numpy.int16)
+        finally:
+            process.stdout.close()
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+
+        # Case file can not be decoded
+        if process.returncode != 0:
+            raise IOError("Error: ffmpeg could not decode {}.".format(filename))
 
     '''
     Function to convert an input signal from stereo to mono
@@ -115,28 +236,41 @@ class AudioSignal(object):
 
     '''
     Function to split the input signal into windows of same size
+    With view=True, return a read-only strided view (frames x window) of the signal and the window to apply,
+    without copying any sample. Otherwise, return one AudioSignal per frame.
     '''
-    def framing(self, size, step, hamming=False):
+    def framing(self, size, step, hamming=False, view=False):
 
         # Rescale windows step and size
         win_size = int(size * self._sample_rate)
         win_step = int(step * self._sample_rate)
 
-        # Number of frames
-        nb_frames = 1 + int((len(self._signal) - win_size) / win_step)
-
         # Build Hamming function
         if hamming is True:
-            ham = numpy.hamming(win_size)
+            ham = numpy.hamming(win_size).astype(self._dtype)
         else:
-            ham = numpy.ones(win_size)
+            ham = numpy.ones(win_size, dtype=self._dtype)
+
+        # Split signals into a read-only strided view (one row per frame)
+        frames = sliding_window_view(numpy.asarray(self._signal), win_size)[::win_step]
+
+        # Return the view and the window to apply lazily
+        if view is True:
+            return frames, ham
+
+        # Wrap each windows (multiplied by Hamming functions) in its own signal
+        return [AudioSignal(self._sample_rate, signal=frame * ham, dtype=self._dtype) for frame in frames]
+
+    '''
+    Function to split the input signal into a 2-D array of windows (one row per frame)
+    '''
+    def frame_array(self, size, step, hamming=False):
+
+        # Get frames view and window
+        frames, ham = self.framing(size, step, hamming=hamming, view=True)
 
-        # Split signals (and multiply each windows signals by Hamming functions)
-        frames = []
-        for t in range(nb_frames):
-            sub_signal = AudioSignal(self._sample_rate, signal=self._signal[(t * win_step): (t * win_step + win_size)] * ham)
-            frames.append(sub_signal)
-        return frames
+        # Multiply each windows signals by Hamming functions (single allocation)
+        return numpy.multiply(frames, ham, dtype=self._dtype)
 
     '''
     Function to compute the magnitude of the Discrete Fourier Transform coefficient
@@ -145,9 +279,9 @@ class AudioSignal(object):
 
         # Commpute the magnitude of the spectrum (and normalize by the number of sample)
         if norm is True:
-            dft = abs(fft(self._signal)) / len(self._signal)
+            dft = abs(fft(numpy.asarray(self._signal, dtype=self._dtype))) / len(self._signal)
         else:
-            dft = abs(fft(self._signal))
+            dft = abs(fft(numpy.asarray(self._signal, dtype=self._dtype)))
         return dft
 
     '''
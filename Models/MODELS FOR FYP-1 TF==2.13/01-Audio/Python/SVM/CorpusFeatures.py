@@ -0,0 +1,233 @@
+import os
+import sys
+import json
+import pickle
+import time
+import argparse
+import multiprocessing
+from numpy.lib.format import open_memmap
+from AudioLibrary.AudioSignal import *
+from AudioLibrary.AudioFeatures import *
+
+
+'''
+Corpus feature extraction
+
+Extract the global statistics features of every audio file of a corpus directory with a pool of processes:
+
+    python -m AudioLibrary.CorpusFeatures ../Datas/RAVDESS ../Datas/Features --label ravdess --workers 8
+
+The output directory holds:
+    - features.npy: memory-mapped feature matrix (one row per file, one column per feature)
+    - done.npy: memory-mapped checkpoint (True once the row of a file is written)
+    - index.json: extraction parameters, feature names, file names and labels of each row
+
+Running the same command again resumes from the checkpoint.
+'''
+
+# Audio and video file extensions
+AUDIO_EXTENSIONS = ['.wav', '.mp3', '.mp4', '.mkv', '.avi']
+
+# RAVDESS Database
+LABEL_DICT_RAVDESS = {'02': 'NEU', '03': 'HAP', '04': 'SAD', '05': 'ANG', '06': 'FEA', '07': 'DIS', '08': 'SUR'}
+
+# Features parameters of the worker processes
+_worker_param = None
+
+
+'''
+Function to set audio files labels from the parent directory name
+'''
+def set_label_dirname(audio_file, gender_differentiation=False):
+    return os.path.basename(os.path.dirname(audio_file))
+
+
+'''
+Function to set audio files labels from RAVDESS file names (None if the emotion is not used)
+'''
+def set_label_ravdess(audio_file, gender_differentiation=True):
+    audio_file = os.path.basename(audio_file)
+    label = LABEL_DICT_RAVDESS.get(audio_file[6:-16])
+    if label is not None and gender_differentiation is True:
+        if int(audio_file[18:-4]) % 2 == 0:  # Female
+            label = 'f_' + label
+        else:  # Male
+            label = 'm_' + label
+    return label
+
+
+'''
+Function to list the labelled audio files of a corpus directory (sorted so that rows are stable between runs)
+'''
+def list_corpus(corpus_path, set_label):
+
+    files = []
+    labels = []
+    for root, dirs, names in os.walk(corpus_path):
+        dirs.sort()
+        for name in sorted(names):
+            if os.path.splitext(name)[1] in AUDIO_EXTENSIONS:
+                label = set_label(os.path.join(root, name))
+                if label is not None:
+                    files.append(os.path.relpath(os.path.join(root, name), corpus_path))
+                    labels.append(label)
+    return files, labels
+
+
+'''
+Worker process initialization
+'''
+def init_worker(param):
+    global _worker_param
+    _worker_param = param
+
+
+'''
+Worker function computing the global statistics features of one file
+'''
+def extract_features(task):
+
+    # Row index and file name
+    row, filename = task
+
+    try:
+        audio_signal = AudioSignal(_worker_param.get("sample_rate"), filename=filename)
+        audio_features = AudioFeatures(audio_signal, _worker_param.get("win_size"), _worker_param.get("win_step"))
+        features, _ = audio_features.global_feature_extraction(stats=_worker_param.get("stats"),
+                                                               features_list=_worker_param.get("features_list"),
+                                                               nb_mfcc=_worker_param.get("nb_mfcc"),
+                                                               nb_filter=_worker_param.get("nb_filter"),
+                                                               diff=_worker_param.get("diff"))
+        return row, features, None
+    except Exception as e:
+        return row, None, "{}: {}".format(type(e).__name__, e)
+
+
+'''
+Function to open the output files, either from a previous run (resume) or new ones
+'''
+def open_output(output_path, index):
+
+    index_file = os.path.join(output_path, 'index.json')
+    features_file = os.path.join(output_path, 'features.npy')
+    done_file = os.path.join(output_path, 'done.npy')
+
+    # Resume from checkpoint
+    if os.path.exists(index_file):
+        previous_index = json.load(open(index_file))
+        if previous_index != index:
+            raise ValueError("Error: {} holds features of another corpus or of other parameters.".format(output_path))
+        return open_memmap(features_file, mode='r+'), open_memmap(done_file, mode='r+')
+
+    # New output
+    os.makedirs(output_path, exist_ok=True)
+    shape = (len(index.get("files")), len(index.get("feature_names")))
+    features = open_memmap(features_file, mode='w+', dtype=numpy.float64, shape=shape)
+    done = open_memmap(done_file, mode='w+', dtype=numpy.bool_, shape=(shape[0],))
+    done.flush()
+
+    # Write index last: its presence means the matrices exist
+    with open(index_file, 'w') as f:
+        json.dump(index, f, indent=1)
+
+    return features, done
+
+
+'''
+Function to extract the features of a whole corpus into a memory-mapped matrix
+'''
+def extract_corpus(corpus_path, output_path, param, label='dirname', workers=None, checkpoint_every=100,
+                   chunksize=4):
+
+    # List files and labels
+    set_label = set_label_ravdess if label == 'ravdess' else set_label_dirname
+    files, labels = list_corpus(corpus_path, set_label)
+
+    # Feature names
+    st_names = AudioFeatures.short_time_feature_names(param.get("features_list"), param.get("nb_mfcc"),
+                                                      param.get("nb_filter"))
+    feature_names = AudioFeatures.global_feature_names(st_names, stats=param.get("stats"), diff=param.get("diff"))
+
+    # Open output (or resume)
+    index = {"param": param, "feature_names": feature_names, "files": files, "labels": labels}
+    features, done = open_output(output_path, index)
+
+    # Files left
+    tasks = [(row, os.path.join(corpus_path, files[row])) for row in numpy.flatnonzero(~done)]
+    print("Feature extraction: START ({} files, {} already done)".format(len(files), len(files) - len(tasks)))
+
+    # Extract features with a pool of processes
+    failures = []
+    start_time = time.time()
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(param,)) as pool:
+        for nb_files, (row, row_features, error) in enumerate(pool.imap_unordered(extract_features, tasks,
+                                                                                  chunksize=chunksize), 1):
+            if error is None:
+                features[row] = row_features
+                done[row] = True
+            else:
+                failures.append((files[row], error))
+
+            # Checkpoint and throughput
+            if nb_files % checkpoint_every == 0:
+                features.flush()
+                done.flush()
+                print("Feature extraction: RUNNING ... {} files ({:.1f} clips/s)".format(
+                    nb_files, nb_files / (time.time() - start_time)))
+
+    features.flush()
+    done.flush()
+
+    # Report
+    duration = time.time() - start_time
+    print("Feature extraction: END! {} files in {:.1f} s ({:.1f} clips/s)".format(
+        len(tasks), duration, len(tasks) / duration if duration > 0 else 0.0))
+    for filename, error in failures:
+        print("Error: {} ({})".format(filename, error))
+
+    return features, done, index
+
+
+'''
+Command line
+'''
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Extract global statistics features of an audio corpus.")
+    parser.add_argument('corpus', help="corpus directory")
+    parser.add_argument('output', help="output directory (features.npy, done.npy and index.json)")
+    parser.add_argument('--param', default=None, help="MODEL_PARAM.p file to take the features parameters from")
+    parser.add_argument('--label', default='dirname', choices=['dirname', 'ravdess'], help="how files are labelled")
+    parser.add_argument('--sample-rate', type=int, default=16000)
+    parser.add_argument('--win-size', type=float, default=0.025)
+    parser.add_argument('--win-step', type=float, default=0.01)
+    parser.add_argument('--nb-mfcc', type=int, default=12)
+    parser.add_argument('--nb-filter', type=int, default=40)
+    parser.add_argument('--stats', nargs='+', default=['mean', 'std', 'med', 'kurt', 'skew', 'q1', 'q99', 'min',
+                                                       'max', 'range'])
+    parser.add_argument('--features', nargs='+', default=['zcr', 'energy', 'energy_entropy', 'spectral_centroid',
+                                                          'spectral_spread', 'spectral_entropy', 'spectral_flux',
+                                                          'sprectral_rolloff', 'mfcc'])
+    parser.add_argument('--diff', type=int, nargs='+', default=[0], help="difference orders (e.g. 0 1 2)")
+    parser.add_argument('--workers', type=int, default=None, help="number of processes (default: all CPUs)")
+    parser.add_argument('--checkpoint-every', type=int, default=100, help="files between two checkpoints")
+    args = parser.parse_args(argv)
+
+    # Features parameters
+    param = {"sample_rate": args.sample_rate, "win_size": args.win_size, "win_step": args.win_step,
+             "nb_mfcc": args.nb_mfcc, "nb_filter": args.nb_filter, "stats": args.stats,
+             "features_list": args.features, "diff": args.diff if len(args.diff) > 1 else args.diff[0]}
+
+    # Take features parameters from a trained model
+    if args.param is not None:
+        model_param = pickle.load(open(args.param, 'rb'))
+        param.update({"win_size": float(model_param.get("win_size")), "win_step": float(model_param.get("win_step")),
+                      "nb_mfcc": int(model_param.get("nb_mfcc")), "stats": list(model_param.get("stats")),
+                      "features_list": list(model_param.get("features_list")), "diff": model_param.get("diff")})
+
+    extract_corpus(args.corpus, args.output, param, label=args.label, workers=args.workers,
+                   checkpoint_every=args.checkpoint_every)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
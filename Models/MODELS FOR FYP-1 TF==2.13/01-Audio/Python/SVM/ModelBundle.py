@@ -0,0 +1,237 @@
+import os
+import sys
+import json
+import pickle
+import shutil
+import hashlib
+import argparse
+import tempfile
+import importlib
+import numpy
+
+
+'''
+Speech emotion model bundle
+
+A trained model (classifier, features parameters, scaler, PCA and label encoder) stored in a single directory:
+    - manifest.json: format version, features parameters, estimators classes and non numeric attributes, the
+      checksum of every array file and the checksum of the manifest itself
+    - arrays/*.npy: numeric attributes (scaler mean and std, PCA components, support vectors, ...), loaded as
+      copy-on-write memory maps so that worker processes share the same pages
+
+Convert the pickle files of a model directory (MODEL_CLF.p, MODEL_PARAM.p, MODEL_SCALER.p, MODEL_PCA.p,
+MODEL_ENCODER.p) into a bundle:
+
+    python -m AudioLibrary.ModelBundle ../Models/SVM ../Models/SVM.bundle
+    python -m AudioLibrary.ModelBundle --verify ../Models/SVM.bundle
+'''
+
+# Bundle format name and version (the version changes when the layout changes)
+BUNDLE_FORMAT = "audio-emotion-svm"
+BUNDLE_VERSION = 1
+
+# Estimators of a model
+ESTIMATORS = ['clf', 'pca', 'encoder']
+
+
+'''
+Function to tell whether a path is a model bundle directory
+'''
+def is_bundle(path):
+    return os.path.isfile(os.path.join(path, 'manifest.json'))
+
+
+'''
+Function to hash a file content
+'''
+def file_checksum(filename, block_size=1 << 20):
+    file_hash = hashlib.blake2b(digest_size=20)
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+'''
+Function to hash a manifest (all entries but its own checksum)
+'''
+def manifest_checksum(manifest):
+    content = {key: value for key, value in manifest.items() if key != "checksum"}
+    return hashlib.blake2b(json.dumps(content, sort_keys=True).encode(), digest_size=20).hexdigest()
+
+
+'''
+Function to encode an attribute value as JSON, moving numeric arrays to arrays (name -> array)
+Object arrays (e.g. classes_ of a label encoder fit on strings, feature_names_in_) are stored in the manifest, as the
+shape and the encoded items of the array
+'''
+def encode_value(value, name, arrays):
+    if isinstance(value, numpy.ndarray) and value.dtype != object:
+        arrays[name] = value
+        return {"array": name}
+    elif isinstance(value, numpy.ndarray):
+        return {"object_array": [encode_value(v, name + "_" + str(i), arrays) for i, v in enumerate(value.flat)],
+                "shape": list(value.shape)}
+    elif isinstance(value, numpy.generic):
+        return {"scalar": value.item(), "dtype": value.dtype.str}
+    elif isinstance(value, tuple):
+        return {"tuple": [encode_value(v, name + "_" + str(i), arrays) for i, v in enumerate(value)]}
+    elif isinstance(value, list):
+        return [encode_value(v, name + "_" + str(i), arrays) for i, v in enumerate(value)]
+    elif isinstance(value, dict):
+        return {"dict": {str(k): encode_value(v, name + "_" + str(k), arrays) for k, v in value.items()}}
+    elif value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    raise ValueError("Error: {} ({}) cannot be stored in a model bundle.".format(name, type(value).__name__))
+
+
+'''
+Function to decode an attribute value encoded by encode_value
+'''
+def decode_value(value, arrays):
+    if isinstance(value, list):
+        return [decode_value(v, arrays) for v in value]
+    elif isinstance(value, dict):
+        if "array" in value:
+            return arrays[value["array"]]
+        elif "object_array" in value:
+            array = numpy.empty(len(value["object_array"]), dtype=object)
+            for i, v in enumerate(value["object_array"]):
+                array[i] = decode_value(v, arrays)
+            return array.reshape(value["shape"])
+        elif "scalar" in value:
+            return numpy.dtype(value["dtype"]).type(value["scalar"])
+        elif "tuple" in value:
+            return tuple(decode_value(v, arrays) for v in value["tuple"])
+        return {k: decode_value(v, arrays) for k, v in value["dict"].items()}
+    return value
+
+
+'''
+Function to write a model bundle (written in a temporary directory then moved, so that readers never see a partial
+bundle)
+'''
+def save_bundle(bundle_path, clf, param, scaler, pca, encoder):
+
+    # Numeric arrays and JSON description of each estimator
+    arrays = {"scaler_mean": numpy.asarray(scaler[0], dtype=numpy.float64),
+              "scaler_std": numpy.asarray(scaler[1], dtype=numpy.float64)}
+    estimators = {}
+    for role, estimator in zip(ESTIMATORS, [clf, pca, encoder]):
+        state = estimator.__getstate__() if hasattr(estimator, '__getstate__') else vars(estimator)
+        estimators[role] = {"class": type(estimator).__module__ + "." + type(estimator).__name__,
+                            "state": encode_value(dict(state), role, arrays)["dict"]}
+    param = encode_value(dict(param), "param", arrays)
+
+    # Write arrays
+    tmp_path = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(bundle_path)), suffix='.tmp')
+    os.makedirs(os.path.join(tmp_path, 'arrays'))
+    files = {}
+    for name, array in arrays.items():
+        filename = os.path.join('arrays', name + '.npy')
+        numpy.save(os.path.join(tmp_path, filename), numpy.ascontiguousarray(array))
+        files[name] = {"file": filename, "dtype": array.dtype.str, "shape": list(array.shape),
+                       "checksum": file_checksum(os.path.join(tmp_path, filename))}
+
+    # Write manifest
+    manifest = {"format": BUNDLE_FORMAT, "version": BUNDLE_VERSION,
+                "param": param, "estimators": estimators, "arrays": files}
+    manifest["checksum"] = manifest_checksum(manifest)
+    with open(os.path.join(tmp_path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+    # Replace previous bundle
+    if os.path.exists(bundle_path):
+        shutil.rmtree(bundle_path)
+    os.replace(tmp_path, bundle_path)
+
+    return manifest
+
+
+'''
+Function to load a model bundle
+With mmap=True, arrays are copy-on-write memory maps (pages are shared between processes as long as they are not
+written, and libsvm gets the writable buffers it requires); with verify=True, the manifest and array files are checked
+against their checksums (worker processes can skip it once the parent process has verified the bundle)
+Returns the classifier, features parameters, scaler (mean, std), PCA and label encoder
+'''
+def load_bundle(bundle_path, mmap=True, verify=True):
+
+    # Read manifest
+    with open(os.path.join(bundle_path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != BUNDLE_FORMAT or manifest.get("version") != BUNDLE_VERSION:
+        raise ValueError("Error: {} is not a version {} {} bundle.".format(bundle_path, BUNDLE_VERSION, BUNDLE_FORMAT))
+    if verify is True and manifest_checksum(manifest) != manifest.get("checksum"):
+        raise ValueError("Error: manifest of {} does not match its checksum.".format(bundle_path))
+
+    # Load arrays
+    arrays = {}
+    for name, entry in manifest.get("arrays").items():
+        filename = os.path.join(bundle_path, entry.get("file"))
+        if verify is True and file_checksum(filename) != entry.get("checksum"):
+            raise ValueError("Error: {} does not match its checksum.".format(filename))
+        arrays[name] = numpy.load(filename, mmap_mode='c' if mmap is True else None)
+
+    # Rebuild estimators
+    estimators = []
+    for role in ESTIMATORS:
+        module_name, class_name = manifest["estimators"][role]["class"].rsplit('.', 1)
+        estimator_class = getattr(importlib.import_module(module_name), class_name)
+        estimator = estimator_class.__new__(estimator_class)
+        state = decode_value({"dict": manifest["estimators"][role]["state"]}, arrays)
+        if hasattr(estimator, '__setstate__'):
+            estimator.__setstate__(state)
+        else:
+            vars(estimator).update(state)
+        estimators.append(estimator)
+
+    clf, pca, encoder = estimators
+    param = decode_value(manifest.get("param"), arrays)
+    return clf, param, (arrays["scaler_mean"], arrays["scaler_std"]), pca, encoder
+
+
+'''
+Function to convert the pickle files of a model directory into a model bundle
+'''
+def convert_model(model_path, bundle_path):
+    models = []
+    for name in ['CLF', 'PARAM', 'SCALER', 'PCA', 'ENCODER']:
+        with open(os.path.join(model_path, 'MODEL_' + name + '.p'), 'rb') as f:
+            models.append(pickle.load(f))
+    return save_bundle(bundle_path, *models)
+
+
+'''
+Command line
+'''
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Convert a pickled speech emotion model into a model bundle.")
+    parser.add_argument('model', help="model directory (MODEL_*.p files), or bundle directory with --verify")
+    parser.add_argument('bundle', nargs='?', default=None, help="bundle directory to write")
+    parser.add_argument('--verify', action='store_true', help="check the checksums of a bundle")
+    args = parser.parse_args(argv)
+
+    # Check a bundle
+    if args.verify is True:
+        try:
+            load_bundle(args.model, verify=True)
+        except ValueError as e:
+            print(e)
+            return 1
+        print("Bundle {}: OK".format(args.model))
+        return 0
+
+    if args.bundle is None:
+        parser.error("the bundle directory is required")
+
+    # Convert pickles
+    manifest = convert_model(args.model, args.bundle)
+    print("Bundle {}: {} arrays, checksum {}".format(args.bundle, len(manifest.get("arrays")),
+                                                     manifest.get("checksum")))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
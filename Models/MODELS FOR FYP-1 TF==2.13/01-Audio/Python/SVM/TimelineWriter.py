@@ -0,0 +1,164 @@
+import os
+import re
+import tempfile
+import numpy
+
+
+'''
+Speech emotion timelines
+
+Predictions of many files (one row per chunk: source file, timestamp, emotion and optionally the probability of every
+class) appended to a directory of columnar shards. Rows are buffered in memory and written shard_size rows at a time
+as timeline-00000.npz, timeline-00001.npz, ... (one array per column, written to a temporary file then moved, so that
+a shard is always complete). Opening an existing directory appends new shards after the previous ones.
+
+    writer = TimelineWriter('Scores', classes=['Angry', 'Disgust', 'Fear', 'Happy', 'Neutral', 'Sad', 'Surprise'])
+    writer.append('audio_1.wav', emotions, timestamps, probabilities)
+    writer.close()
+    timeline = read_timeline('Scores', columns=['source', 'timestamp', 'emotion'])
+
+Columns of a shard:
+    - source: audio file of each row
+    - timestamp: end of each chunk (unit of the model timestamps)
+    - emotion: predicted emotion of each row
+    - probabilities: (rows, classes) float32 matrix, only when the writer has classes
+    - classes: class of each probabilities column
+'''
+
+# Shard file names
+SHARD_PATTERN = re.compile(r'^timeline-(\d+)\.npz$')
+
+
+'''
+Function to list the shards of a timeline directory (in writing order)
+'''
+def list_shards(timeline_path):
+    if not os.path.isdir(timeline_path):
+        return []
+    shards = sorted((int(match.group(1)), name) for name, match in
+                    ((name, SHARD_PATTERN.match(name)) for name in os.listdir(timeline_path)) if match is not None)
+    return [os.path.join(timeline_path, name) for _, name in shards]
+
+
+'''
+Function to read the columns of a timeline (all columns by default), optionally the rows of some source files only
+Only the requested columns are read from each shard
+'''
+def read_timeline(timeline_path, columns=None, sources=None):
+
+    parts = {}
+    for shard in list_shards(timeline_path):
+        with numpy.load(shard) as data:
+
+            # Rows of the requested sources
+            rows = numpy.isin(data['source'], list(sources)) if sources is not None else slice(None)
+
+            for column in (columns if columns is not None else data.files):
+                if column == 'classes':
+                    parts[column] = [data[column]]
+                elif column in data.files:
+                    parts.setdefault(column, []).append(data[column][rows])
+
+    return {column: numpy.concatenate(values) if column != 'classes' else values[0]
+            for column, values in parts.items()}
+
+
+'''
+Function to list the source files of a timeline (reads the source column only)
+'''
+def timeline_sources(timeline_path):
+    return set(read_timeline(timeline_path, columns=['source']).get('source', []))
+
+
+class TimelineWriter:
+
+    def __init__(self, timeline_path, classes=None, shard_size=100000, compress=False):
+
+        # Timeline directory
+        self._timeline_path = timeline_path
+        os.makedirs(timeline_path, exist_ok=True)
+
+        # Class of each probabilities column (None to write emotions only)
+        self.classes = list(classes) if classes is not None else None
+
+        # Rows per shard and shard compression
+        self._shard_size = shard_size
+        self._compress = compress
+
+        # Next shard number (after the shards of previous runs)
+        shards = list_shards(timeline_path)
+        self._next_shard = int(SHARD_PATTERN.match(os.path.basename(shards[-1])).group(1)) + 1 if shards else 0
+
+        # Buffered rows (one list of arrays per column)
+        self._buffer = {"source": [], "timestamp": [], "emotion": [], "probabilities": []}
+        self._nb_rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    '''
+    Function to append the predictions of one source file (emotion and timestamp of each chunk, and probabilities of
+    each class when the writer has classes), writing shards as the buffer fills
+    '''
+    def append(self, source, emotions, timestamps, probabilities=None):
+
+        nb_rows = len(emotions)
+        if len(timestamps) != nb_rows:
+            raise ValueError("Error: {} emotions but {} timestamps.".format(nb_rows, len(timestamps)))
+        if (probabilities is None) != (self.classes is None):
+            raise ValueError("Error: probabilities are required if and only if the timeline has classes.")
+
+        # Buffer columns
+        self._buffer["source"].append(numpy.full(nb_rows, str(source)))
+        self._buffer["timestamp"].append(numpy.asarray(timestamps, dtype=numpy.float64).reshape(nb_rows))
+        self._buffer["emotion"].append(numpy.asarray(emotions, dtype=str).reshape(nb_rows))
+        if probabilities is not None:
+            probabilities = numpy.asarray(probabilities, dtype=numpy.float32)
+            if probabilities.shape != (nb_rows, len(self.classes)):
+                raise ValueError("Error: probabilities of shape {} for {} rows and {} classes.".format(
+                    probabilities.shape, nb_rows, len(self.classes)))
+            self._buffer["probabilities"].append(probabilities)
+        self._nb_rows += nb_rows
+
+        # Write full shards
+        if self._nb_rows >= self._shard_size:
+            self.flush()
+
+    '''
+    Function to write the buffered rows as one shard
+    '''
+    def flush(self):
+
+        if self._nb_rows == 0:
+            return None
+
+        # Columns of the shard
+        columns = {column: numpy.concatenate(values) for column, values in self._buffer.items() if len(values) > 0}
+        if self.classes is not None:
+            columns["classes"] = numpy.asarray(self.classes, dtype=str)
+
+        # Write to a temporary file then move it
+        shard = os.path.join(self._timeline_path, "timeline-{:05d}.npz".format(self._next_shard))
+        fd, tmp_path = tempfile.mkstemp(dir=self._timeline_path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            if self._compress is True:
+                numpy.savez_compressed(f, **columns)
+            else:
+                numpy.savez(f, **columns)
+        os.replace(tmp_path, shard)
+
+        # Empty buffer
+        self._next_shard += 1
+        self._buffer = {column: [] for column in self._buffer}
+        self._nb_rows = 0
+
+        return shard
+
+    '''
+    Function to write the last buffered rows
+    '''
+    def close(self):
+        self.flush()
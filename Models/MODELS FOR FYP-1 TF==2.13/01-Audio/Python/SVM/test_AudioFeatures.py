@@ -0,0 +1,240 @@
+import warnings
+import unittest
+import numpy
+from scipy.fftpack import fft
+from scipy.fftpack.realtransforms import dct
+from scipy.stats import kurtosis, skew
+from AudioLibrary.AudioSignal import *
+from AudioLibrary.AudioFeatures import *
+
+
+'''
+Vectorized short-time and global features checked against a per-frame reference, and sliding global statistics
+checked against global_statistics on the slice of each chunk
+
+    python -m unittest AudioLibrary.test_AudioFeatures
+'''
+
+# Short-time features, statistics and difference orders of the global features
+ST_FEATURES = ['zcr', 'energy', 'energy_entropy', 'spectral_centroid', 'spectral_spread', 'spectral_entropy',
+               'spectral_flux', 'sprectral_rolloff', 'mfcc']
+STATS = ['mean', 'med', 'std', 'kurt', 'skew', 'min', 'max', 'q1', 'q99', 'range']
+DIFFS = [0, 1, 2]
+
+
+'''
+Per-frame reference of the short-time features: each frame is windowed, transformed and measured on its own
+'''
+def per_frame_short_time_features(signal, sample_rate, win_size, win_step, features, nb_mfcc=12, nb_filter=40,
+                                  nb_fft=512, eps=10e-8):
+
+    # Rescale windows step and size
+    size = int(win_size * sample_rate)
+    step = int(win_step * sample_rate)
+    nb_frames = 1 + (len(signal) - size) // step
+    ham = numpy.hamming(size)
+
+    # Mel filter bank
+    mel_points = numpy.linspace(0, 2595 * numpy.log10(1 + (sample_rate / 2) / 700), nb_filter + 2)
+    bins = numpy.floor((nb_fft + 1) * (700 * (10 ** (mel_points / 2595) - 1)) / sample_rate)
+    fbank = numpy.zeros((nb_filter, nb_fft // 2 + 1))
+    for m in range(1, nb_filter + 1):
+        for k in range(int(bins[m - 1]), int(bins[m])):
+            fbank[m - 1, k] = (k - bins[m - 1]) / (bins[m] - bins[m - 1])
+        for k in range(int(bins[m]), int(bins[m + 1])):
+            fbank[m - 1, k] = (bins[m + 1] - k) / (bins[m + 1] - bins[m])
+
+    # Entropy of the normalized energies of 10 sub-blocks
+    def entropy(x):
+        sub_len = len(x) // 10
+        sub_energies = numpy.sum(x[:sub_len * 10].reshape(sub_len, 10, order='F') ** 2, axis=0)
+        sub_energies = sub_energies / (numpy.sum(x ** 2) + eps)
+        return -numpy.sum(sub_energies * numpy.log2(sub_energies + eps))
+
+    rows = []
+    for t in range(nb_frames):
+        frame = signal[t * step:t * step + size] * ham
+        dft = (abs(fft(frame)) / size)[:int(win_size * sample_rate / 2)]
+        dft_prev = dft if t == 0 else dft_prev
+
+        # Spectral centroid and spread
+        sr = numpy.arange(1, len(dft) + 1) * (sample_rate / (2.0 * len(dft)))
+        norm_dft = dft / (dft.max() + eps)
+        centroid = numpy.sum(sr * norm_dft) / (numpy.sum(norm_dft) + eps)
+        spread = numpy.sqrt(numpy.sum((sr - centroid) ** 2 * norm_dft) / (numpy.sum(norm_dft) + eps))
+
+        # Spectral roll off
+        [roll_off, ] = numpy.nonzero(numpy.cumsum(dft ** 2) + eps > 0.90 * numpy.sum(dft ** 2))
+
+        values = {
+            'zcr': numpy.sum(numpy.abs(numpy.diff(numpy.sign(frame)))) / (2 * numpy.float64(size - 1.0)),
+            'energy': numpy.sum(frame ** 2) / numpy.float64(size),
+            'energy_entropy': entropy(frame),
+            'spectral_centroid': centroid / (sample_rate / 2.0),
+            'spectral_spread': spread / (sample_rate / 2.0),
+            'spectral_entropy': entropy(dft),
+            'spectral_flux': numpy.sum((dft / numpy.sum(dft + eps) - dft_prev / numpy.sum(dft_prev + eps)) ** 2),
+            'sprectral_rolloff': roll_off[0] / float(len(dft)) if len(roll_off) > 0 else 0.0,
+        }
+        row = [values[f] for f in features if f not in ['mfcc', 'filter_banks']]
+
+        # MFCCs and Filter Banks
+        filter_banks = numpy.dot((1.0 / nb_fft) * numpy.abs(numpy.fft.rfft(frame, nb_fft)) ** 2, fbank.T)
+        filter_banks = 20 * numpy.log10(numpy.where(filter_banks == 0, numpy.finfo(float).eps, filter_banks))
+        if 'mfcc' in features:
+            row += list(dct(filter_banks, type=2, norm='ortho')[1:nb_mfcc + 1])
+        if 'filter_banks' in features:
+            row += list(filter_banks)
+
+        rows.append(row)
+        dft_prev = dft
+
+    # Feature names
+    names = [f for f in features if f not in ['mfcc', 'filter_banks']]
+    if 'mfcc' in features:
+        names += ["mfcc_{0:d}".format(i) for i in range(1, nb_mfcc + 1)]
+    if 'filter_banks' in features:
+        names += ["fbank_{0:d}".format(i) for i in range(1, nb_filter + 1)]
+
+    return numpy.array(rows), names
+
+
+'''
+Per-feature reference of the global statistics of one difference order (statistic major, then short-time feature)
+'''
+def per_feature_global_statistics(st_features, f_names, stats, diff):
+
+    functions = {
+        'mean': numpy.mean, 'med': numpy.median, 'std': numpy.std, 'kurt': kurtosis, 'skew': skew,
+        'min': numpy.min, 'max': numpy.max, 'q1': lambda x: numpy.percentile(x, 1),
+        'q99': lambda x: numpy.percentile(x, 99),
+        'range': lambda x: numpy.abs(numpy.percentile(x, 99) - numpy.percentile(x, 1)),
+    }
+
+    features, names = [], []
+    for stat in stats:
+        for i, f in enumerate(f_names):
+            feat = st_features[:, i]
+            if diff > 0:
+                feat = feat[diff:] - feat[:-diff]
+            features.append(functions[stat](feat))
+            names.append(f + "_d" + str(diff) + "_" + stat)
+
+    return numpy.array(features), names
+
+
+class TestPerFrameReference(unittest.TestCase):
+
+    '''
+    Function to compare the global features of a signal with the per-frame and per-feature references
+    '''
+    def assert_global_features(self, sample_rate, signal, features):
+
+        audio_features = AudioFeatures(AudioSignal(sample_rate, signal=signal), 0.025, 0.01)
+        st_features, f_names = audio_features.short_time_feature_extraction(features)
+        expected_st, expected_f_names = per_frame_short_time_features(signal, sample_rate, 0.025, 0.01, features)
+
+        self.assertEqual(f_names, expected_f_names)
+        numpy.testing.assert_allclose(st_features, expected_st, rtol=1e-10, atol=1e-10)
+
+        for diff in DIFFS + [DIFFS]:
+            features_d, names = audio_features.global_feature_extraction(STATS, features, diff=diff)
+            expected, expected_names = [], []
+            for d in ([diff] if numpy.isscalar(diff) else diff):
+                values, value_names = per_feature_global_statistics(expected_st, expected_f_names, STATS, d)
+                expected.append(values)
+                expected_names += value_names
+
+            self.assertEqual(names, expected_names)
+            numpy.testing.assert_allclose(features_d, numpy.concatenate(expected), rtol=1e-10, atol=1e-10,
+                                          err_msg="diff {}".format(diff))
+
+    '''
+    Speech-like signal: modulated tone with pauses of faint noise
+    '''
+    def test_speech_with_pauses(self):
+
+        sample_rate = 16000
+        rng = numpy.random.default_rng(2)
+        t = numpy.arange(sample_rate) / sample_rate
+        signal = numpy.sin(2 * numpy.pi * (150 + 50 * numpy.sin(2 * numpy.pi * 3 * t)) * t)
+        signal *= (numpy.sin(2 * numpy.pi * 2 * t) > 0.3)
+        signal += 1e-4 * rng.standard_normal(len(t))
+        self.assert_global_features(sample_rate, signal, ST_FEATURES + ['filter_banks'])
+
+    '''
+    Only the features computed one by one, then only the Filter Banks
+    '''
+    def test_feature_subsets(self):
+
+        sample_rate = 8000
+        signal = numpy.random.default_rng(3).standard_normal(sample_rate // 2)
+        self.assert_global_features(sample_rate, signal, ST_FEATURES[:-1])
+        self.assert_global_features(sample_rate, signal, ['filter_banks'])
+
+
+class TestSlidingGlobalStatistics(unittest.TestCase):
+
+    '''
+    Function to compare the sliding statistics of the chunks of a short-time features matrix with global_statistics
+    on each chunk slice (NaN where the reference is NaN)
+    '''
+    def assert_sliding_statistics(self, st_features, nb_frames, hop, stats=STATS, diff=DIFFS):
+
+        f_names = ["f" + str(i) for i in range(st_features.shape[1])]
+        nb_windows = (len(st_features) - nb_frames) // hop + 1
+
+        with numpy.errstate(all='ignore'), warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            features, names = AudioFeatures.sliding_global_statistics(st_features, f_names, nb_frames, hop, nb_windows,
+                                                                      stats=stats, diff=diff)
+            for i in range(nb_windows):
+                expected, expected_names = AudioFeatures.global_statistics(
+                    st_features[i * hop:i * hop + nb_frames], f_names, stats=stats, diff=diff)
+                self.assertEqual(names, expected_names)
+                numpy.testing.assert_allclose(features[i], expected, rtol=1e-7, atol=1e-9,
+                                              err_msg="window {}".format(i))
+
+    '''
+    Short-time features of a speech-like signal: bursts of modulated tones separated by pauses of faint noise
+    '''
+    def test_speech_with_pauses(self):
+
+        sample_rate = 16000
+        rng = numpy.random.default_rng(0)
+        t = numpy.arange(4 * sample_rate) / sample_rate
+        signal = numpy.sin(2 * numpy.pi * (150 + 50 * numpy.sin(2 * numpy.pi * 3 * t)) * t)
+        signal *= (numpy.sin(2 * numpy.pi * 0.5 * t) > 0.3)
+        signal += 1e-4 * rng.standard_normal(len(t))
+
+        audio_features = AudioFeatures(AudioSignal(sample_rate, signal=signal), 0.025, 0.01)
+        st_features, _ = audio_features.short_time_feature_extraction(ST_FEATURES)
+        self.assert_sliding_statistics(st_features, nb_frames=98, hop=25)
+
+    '''
+    Short-time features of a steady tone (nearly constant within every window)
+    '''
+    def test_steady_tone(self):
+
+        sample_rate = 16000
+        t = numpy.arange(2 * sample_rate) / sample_rate
+        signal = numpy.sin(2 * numpy.pi * 440 * t)
+
+        audio_features = AudioFeatures(AudioSignal(sample_rate, signal=signal), 0.025, 0.01)
+        st_features, _ = audio_features.short_time_feature_extraction(ST_FEATURES)
+        self.assert_sliding_statistics(st_features, nb_frames=50, hop=10)
+
+    '''
+    Windows of constant and nearly constant columns far from the scale of the whole matrix
+    '''
+    def test_near_constant_windows(self):
+
+        rng = numpy.random.default_rng(1)
+        st_features = rng.standard_normal((300, 3)) * [1e3, 1.0, 1e-3]
+        st_features[100:200, 0] = 5e3 + 1e-6 * rng.standard_normal(100)
+        st_features[100:200, 1] = 7.0
+        self.assert_sliding_statistics(st_features, nb_frames=40, hop=20)
+
+
+if __name__ == '__main__':
+    unittest.main()
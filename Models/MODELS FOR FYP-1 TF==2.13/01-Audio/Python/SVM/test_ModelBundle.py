@@ -0,0 +1,99 @@
+import os
+import shutil
+import pickle
+import tempfile
+import unittest
+import numpy
+from sklearn.svm import SVC
+from sklearn.decomposition import PCA
+from sklearn.preprocessing import LabelEncoder
+from AudioLibrary.ModelBundle import *
+
+
+'''
+Model bundles checked against the pickled estimators they are converted from
+
+    python -m unittest AudioLibrary.test_ModelBundle
+'''
+
+
+class TestModelBundle(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    '''
+    Function to write the pickle files of a small model whose label encoder is fit on string labels (object classes)
+    and whose PCA has feature names
+    '''
+    def write_model(self):
+
+        rng = numpy.random.default_rng(0)
+        features = rng.standard_normal((60, 6))
+        labels = numpy.array(["f_happy", "m_angry", "m_sad"], dtype=object)[numpy.arange(60) % 3]
+        features[:, 0] += numpy.arange(60) % 3
+
+        encoder = LabelEncoder().fit(labels)
+        scaler = (features.mean(axis=0), features.std(axis=0))
+        pca = PCA(n_components=4).fit((features - scaler[0]) / scaler[1])
+        pca.feature_names_in_ = numpy.array(["f" + str(i) for i in range(6)], dtype=object)
+        clf = SVC(probability=True, random_state=0).fit(pca.transform((features - scaler[0]) / scaler[1]),
+                                                         encoder.transform(labels))
+        param = {"win_size": "0.025", "win_step": "0.01", "stats": ["mean", "std"], "diff": [0, 1], "PCA": True}
+
+        model_path = os.path.join(self.tmp_path, 'model')
+        os.makedirs(model_path)
+        for name, model in zip(['CLF', 'PARAM', 'SCALER', 'PCA', 'ENCODER'], [clf, param, scaler, pca, encoder]):
+            with open(os.path.join(model_path, 'MODEL_' + name + '.p'), 'wb') as f:
+                pickle.dump(model, f)
+
+        return model_path, features, (clf, param, scaler, pca, encoder)
+
+    '''
+    Round trip of a model with object arrays: same attributes and predictions after loading the bundle
+    '''
+    def test_round_trip_string_labels(self):
+
+        model_path, features, (clf, param, scaler, pca, encoder) = self.write_model()
+        bundle_path = os.path.join(self.tmp_path, 'model.bundle')
+        convert_model(model_path, bundle_path)
+
+        for mmap in [True, False]:
+            clf_b, param_b, scaler_b, pca_b, encoder_b = load_bundle(bundle_path, mmap=mmap)
+
+            # Object arrays keep their type and items
+            self.assertEqual(encoder_b.classes_.dtype, object)
+            self.assertEqual(list(encoder_b.classes_), list(encoder.classes_))
+            self.assertEqual(pca_b.feature_names_in_.dtype, object)
+            self.assertEqual(list(pca_b.feature_names_in_), list(pca.feature_names_in_))
+            self.assertEqual(param_b, param)
+
+            # Same predictions
+            reduced = pca.transform((features - scaler[0]) / scaler[1])
+            reduced_b = pca_b.transform((features - scaler_b[0]) / scaler_b[1])
+            numpy.testing.assert_array_equal(reduced_b, reduced)
+            numpy.testing.assert_array_equal(encoder_b.inverse_transform(clf_b.predict(reduced_b)),
+                                             encoder.inverse_transform(clf.predict(reduced)))
+            numpy.testing.assert_array_equal(clf_b.predict_proba(reduced_b), clf.predict_proba(reduced))
+
+    '''
+    A modified array file fails the checksum verification
+    '''
+    def test_verify_checksum(self):
+
+        model_path, _, _ = self.write_model()
+        bundle_path = os.path.join(self.tmp_path, 'model.bundle')
+        manifest = convert_model(model_path, bundle_path)
+
+        array_file = os.path.join(bundle_path, manifest["arrays"]["scaler_mean"]["file"])
+        array = numpy.load(array_file)
+        numpy.save(array_file, array + 1.0)
+        with self.assertRaises(ValueError):
+            load_bundle(bundle_path, verify=True)
+
+
+if __name__ == '__main__':
+    unittest.main()